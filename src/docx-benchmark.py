@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+'''
+renders synthetic worksheets (see helper/bench/workbook_generator.py) into a docx and reports cells/second, peak memory and docx size per scenario
+the results go to a json file so that branches can be compared
+
+usage:
+python docx-benchmark.py --config "../conf/config.yml" --output "../out/benchmark.json"
+python docx-benchmark.py --config "../conf/config.yml" --output "../out/benchmark.json" --scenario merges --scenario rich-text --repeat 3
+python docx-benchmark.py --config "../conf/config.yml" --output "../out/benchmark-lxml.json" --table-engine lxml
+'''
+import os
+import sys
+import json
+import time
+import yaml
+import argparse
+import platform
+import tracemalloc
+import subprocess
+
+from helper.logger import *
+from helper.docx.docx_helper import DocxHelper
+from helper.docx.docx_writer import insert_content, set_render_options
+from helper.bench.workbook_generator import generate_worksheet, count_cells
+from helper.gsheet.worksheet_ir import Worksheet
+
+# every scenario is a worksheet shape (see workbook_generator.DEFAULT_SHAPE)
+SCENARIOS = {
+    'plain': {'rows': 500, 'cols': 6},
+    'wide': {'rows': 200, 'cols': 20},
+    'merges': {'rows': 300, 'cols': 8, 'merge-density': 0.15},
+    'rich-text': {'rows': 300, 'cols': 6, 'runs': 5},
+    'styled': {'rows': 300, 'cols': 6, 'border-variety': 6, 'background-variety': 6},
+    'nested': {'rows': 100, 'cols': 4, 'nested-every': 5},
+    'images': {'rows': 100, 'cols': 4, 'image-every': 4},
+    'out-of-cell': {'rows': 300, 'cols': 6, 'out-of-cell-every': 25},
+    'mixed': {'rows': 300, 'cols': 8, 'merge-density': 0.05, 'runs': 3, 'border-variety': 4, 'background-variety': 4, 'nested-every': 20, 'image-every': 30, 'out-of-cell-every': 50}
+}
+
+class DocxBenchmark(object):
+
+	def __init__(self, config_path, output_path, scenarios=None, repeat=1, table_engine='python-docx'):
+		self._config_path = os.path.abspath(config_path)
+		self._output_path = os.path.abspath(output_path)
+		self._scenarios = scenarios
+		self._repeat = repeat
+		self._table_engine = table_engine
+
+	def set_up(self):
+		self._CONFIG = yaml.load(open(self._config_path, 'r', encoding='utf-8'), Loader=yaml.FullLoader)
+		config_dir = os.path.dirname(self._config_path)
+
+		self._CONFIG['dirs']['output-dir'] = os.path.abspath('{0}/{1}'.format(config_dir, self._CONFIG['dirs']['output-dir']))
+		self._CONFIG['dirs']['temp-dir'] = os.path.abspath('{0}/tmp/benchmark'.format(self._CONFIG['dirs']['output-dir']))
+		os.makedirs(self._CONFIG['dirs']['temp-dir'], exist_ok=True)
+
+		self._CONFIG['files']['docx-styles'] = os.path.abspath('{0}/{1}'.format(config_dir, self._CONFIG['files']['docx-styles']))
+		self._CONFIG['files']['docx-template'] = os.path.abspath('{0}/{1}'.format(config_dir, self._CONFIG['files']['docx-template']))
+
+		# the renderer is measured on its own, images are embedded as they are
+		set_render_options({'image-preparer': None, 'table-engine': self._table_engine})
+
+	def render(self, data, docx_path):
+		docxhelper = DocxHelper(self._CONFIG['files']['docx-template'], self._CONFIG['files']['docx-styles'], docx_path)
+		doc = docxhelper.init()
+		spec = docxhelper._sections['continuous_portrait']
+		page_width = spec['page_width'] - spec['left_margin'] - spec['right_margin'] - spec['gutter']
+
+		start_time = time.perf_counter()
+		insert_content(data, doc, page_width, None, None)
+		render_seconds = time.perf_counter() - start_time
+
+		start_time = time.perf_counter()
+		doc.save(docx_path)
+		save_seconds = time.perf_counter() - start_time
+
+		return render_seconds, save_seconds
+
+	def run_scenario(self, name, shape):
+		info('benchmarking {0} : {1}'.format(name, shape))
+		data = generate_worksheet(shape, image_dir=self._CONFIG['dirs']['temp-dir'], title=name)
+		cells = count_cells(data)
+
+		# the renderer works on what table_processor.process gives, the compact form of the worksheet
+		data = Worksheet.from_dict(data)
+		docx_path = os.path.join(self._CONFIG['dirs']['temp-dir'], '{0}.docx'.format(name))
+
+		# timing runs are made without tracemalloc as it slows everything down, the best of them counts
+		timings = [self.render(data, docx_path) for i in range(0, self._repeat)]
+		render_seconds = min(t[0] for t in timings)
+		save_seconds = min(t[1] for t in timings)
+
+		tracemalloc.start()
+		self.render(data, docx_path)
+		current, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+
+		result = {
+			'scenario': name,
+			'shape': shape,
+			'cells': cells,
+			'render-seconds': round(render_seconds, 4),
+			'save-seconds': round(save_seconds, 4),
+			'cells-per-second': round(cells / render_seconds, 1),
+			'peak-memory-bytes': peak,
+			'docx-bytes': os.path.getsize(docx_path)
+		}
+		info('{0} : {1} cells in {2} seconds, {3} cells/second, peak memory {4} bytes, docx {5} bytes'.format(name, cells, result['render-seconds'], result['cells-per-second'], peak, result['docx-bytes']))
+		return result
+
+	def git_revision(self):
+		try:
+			return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+		except:
+			return None
+
+	def run(self):
+		self.set_up()
+		names = self._scenarios or list(SCENARIOS.keys())
+		results = {
+			'revision': self.git_revision(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'repeat': self._repeat,
+			'table-engine': self._table_engine,
+			'scenarios': [self.run_scenario(name, SCENARIOS[name]) for name in names]
+		}
+
+		with open(self._output_path, 'w', encoding='utf-8') as f:
+			f.write(json.dumps(results, sort_keys=False, indent=4))
+
+		info('benchmark results written to {0}'.format(self._output_path))
+
+if __name__ == '__main__':
+	# construct the argument parse and parse the arguments
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-c", "--config", required=True, help="configuration yml path (for the docx template and styles)")
+	ap.add_argument("-o", "--output", required=True, help="json file the results are written to")
+	ap.add_argument("-s", "--scenario", required=False, action='append', choices=list(SCENARIOS.keys()), help="scenario to run (can be given more than once), all scenarios by default")
+	ap.add_argument("-r", "--repeat", required=False, type=int, default=1, help="timing runs per scenario, the best one is reported")
+	ap.add_argument("-e", "--table-engine", required=False, choices=['python-docx', 'lxml'], default='python-docx', help="how table cells are built, see docx-related.table-engine")
+	args = vars(ap.parse_args())
+
+	benchmark = DocxBenchmark(args["config"], args["output"], args["scenario"], args["repeat"], args["table_engine"])
+	benchmark.run()
@@ -3,6 +3,9 @@
 usage:
 ./docx-from-gsheet.py --config '../conf/config.yml'
 python docx-from-gsheet.py --config "../conf/config.yml"
+
+re-render the docx from the json snapshot of the last run (no google access, the images/pdfs it refers to must still be in the tmp dir)
+python docx-from-gsheet.py --config "../conf/config.yml" --from-snapshot
 pip list --outdated --format=freeze | grep -v '^\-e' | cut -d = -f 1  | xargs -n1 pip install -U
 
 [soffice/libreoffice] --headless --convert-to pdf docx-to-convert.docx
@@ -16,26 +19,38 @@ import yaml
 import datetime
 import argparse
 import pprint
+
+from concurrent.futures import ThreadPoolExecutor
 if sys.platform == 'win32':
 	import win32com.client as client
+	import pythoncom
 
 from docx import Document
 
 from helper.logger import *
+from helper.tracer import span, log_summary, write_chrome_trace
 from helper.gsheet.gsheet_helper import GsheetHelper
 from helper.docx.docx_helper import DocxHelper
 from helper.docx.docx_util import *
+from helper.docx.docx_writer import set_render_options, RENDER_OPTIONS
+from helper.docx.table_stream import finish_table_streams, discard_table_streams, clear_table_streams
+from helper.docx.docx_fragment import FragmentCache, referenced_files
+from helper.gsheet.worksheet_ir import json_default, json_object_hook
+from helper.docx.parallel_render import render_sections
+from helper.docx.image_prep import image_preparer
 
 class DocxFromGsheet(object):
 
-	def __init__(self, config_path, gsheet=None):
+	def __init__(self, config_path, gsheet=None, from_snapshot=False):
 		self.start_time = int(round(time.time() * 1000))
 		self._config_path = os.path.abspath(config_path)
-		self._data = {}
 		self._gsheet = gsheet
+		self._from_snapshot = from_snapshot
 
 	def update_toc(self, docx_path, generate_pdf):
 		doc_path = os.path.abspath(docx_path)
+		# batch builds call this from their own threads, com has to be initialized on every one of them
+		pythoncom.CoInitialize()
 		try:
 			word = client.DispatchEx("Word.Application")
 			worddoc = word.Documents.Open(doc_path)
@@ -54,38 +69,111 @@ class DocxFromGsheet(object):
 		finally:
 			word.Quit()
 
-	def generate_docx(self):
-		for section in self._data['sections']:
+	def generate_docx(self, data, doc, docxhelper, config):
+		try:
+			self.render_docx(data, doc, docxhelper, config)
+		except BaseException:
+			# the tables streamed for a docx that is not going to be finished would stay in the tmp dir for good
+			discard_table_streams(doc, RENDER_OPTIONS['stream-dir'])
+			raise
+
+		if sys.platform == 'win32' and config['docx-related']['update-toc']:
+			self.update_toc(config['files']['output-docx'], config['docx-related']['generate-pdf'])
+
+	def render_docx(self, data, doc, docxhelper, config):
+		# section bodies are rendered in worker processes first, the loop below then only adds section breaks/headers/footers and splices them in
+		workers = config['docx-related'].get('render-workers', 0)
+		if workers > 0:
+			render_sections(data['sections'], docxhelper._sections, config, workers)
+
+		for section in data['sections']:
 			content_type = section['content-type']
 
 			# force table formatter for gsheet content
 			if content_type == 'gsheet': content_type = 'table'
 
 			module = importlib.import_module('formatter.{0}_formatter'.format(content_type))
-			module.generate(section, self._doc, self._docxhelper._sections, self._CONFIG)
+			with span('section', section=section['section'], heading=section['heading'], content_type=section['content-type']):
+				module.generate(section, doc, docxhelper._sections, config)
+
+		fragments = config['fragment-cache']
+		if fragments is not None:
+			if config['docx-related'].get('fragment-cache', True):
+				info('{0} of {1} sections reused from the fragment cache'.format(fragments.reused, fragments.reused + fragments.rendered))
+			fragments.prune()
 
-		self._doc.save(self._CONFIG['files']['output-docx'])
-		set_updatefields_true(self._CONFIG['files']['output-docx'])
+		set_updatefields_true(doc)
+		with span('docx-save') as attrs:
+			doc.save(config['files']['output-docx'])
+			# streamed tables go into the saved docx in place of their placeholders
+			finish_table_streams(config['files']['output-docx'], RENDER_OPTIONS['stream-dir'])
+			attrs['bytes'] = os.path.getsize(config['files']['output-docx'])
 
-		if sys.platform == 'win32' and self._CONFIG['docx-related']['update-toc']:
-			self.update_toc(self._CONFIG['files']['output-docx'], self._CONFIG['docx-related']['generate-pdf'])
+	def build(self, gsheet):
+		# one gsheet into one docx, everything specific to this gsheet goes into a config of its own as batch builds run side by side
+		config = {**self._CONFIG, 'files': dict(self._CONFIG['files'])}
+		config['files']['output-json'] = os.path.abspath('{0}/{1}.json'.format(config['dirs']['output-dir'], gsheet))
+		if self._from_snapshot:
+			data = self.load_json(config)
+		else:
+			with span('gsheet', gsheet=gsheet):
+				data = self._gsheethelper.process_gsheet(gsheet)
+
+			self.save_json(data, config)
+
+		# docx-helper
+		config['files']['output-docx'] = os.path.abspath('{0}/{1}.docx'.format(config['dirs']['output-dir'], gsheet))
+		docxhelper = DocxHelper(config['files']['docx-template'], config['files']['docx-styles'], config['files']['output-docx'])
+		doc = docxhelper.init()
+
+		# rendered sections are cached per gsheet, only sections that have changed since the last build are rendered again
+		# parallel rendering goes through the same store, without the cache it only carries what was rendered for this build
+		config['fragment-cache'] = None
+		docx_related = config['docx-related']
+		if docx_related.get('fragment-cache', True) or docx_related.get('render-workers', 0) > 0:
+			config['fragment-cache'] = FragmentCache(os.path.abspath('{0}/fragments/{1}'.format(config['dirs']['temp-dir'], gsheet)), config, reuse=docx_related.get('fragment-cache', True))
+
+		self.generate_docx(data, doc, docxhelper, config)
+
+	def timed_build(self, gsheet):
+		# (gsheet, seconds, error) - in a batch a failed gsheet fails only its own build
+		start_time = time.perf_counter()
+		try:
+			with span('build', gsheet=gsheet):
+				self.build(gsheet)
+			return gsheet, time.perf_counter() - start_time, None
+		except (Exception, SystemExit) as e:
+			error('{0} : build failed : {1}'.format(gsheet, repr(e)))
+			return gsheet, time.perf_counter() - start_time, e
 
 	def run(self):
 		self.set_up()
-		# process gsheets one by one
-		for gsheet in self._CONFIG['gsheets']:
-			self._data = self._gsheethelper.process_gsheet(gsheet)
+		gsheets = self._CONFIG['gsheets']
+		if len(gsheets) == 1:
+			try:
+				self.build(gsheets[0])
+			finally:
+				self.tear_down()
+			return
 
-			self._CONFIG['files']['output-json'] = os.path.abspath('{0}/{1}.json'.format(self._CONFIG['dirs']['output-dir'], gsheet))
-			self.save_json()
+		# batch - gsheets are built side by side on a thread pool, they share the google clients, the spreadsheet index, the media cache and loaded (child) gsheets
+		workers = min(self._CONFIG.get('batch-concurrency', 4), len(gsheets))
+		info('building {0} gsheets, {1} at a time'.format(len(gsheets), workers))
+		with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='build') as executor:
+			results = list(executor.map(self.timed_build, gsheets))
 
-			# docx-helper
-			self._CONFIG['files']['output-docx'] = os.path.abspath('{0}/{1}.docx'.format(self._CONFIG['dirs']['output-dir'], gsheet))
-			self._docxhelper = DocxHelper(self._CONFIG['files']['docx-template'], self._CONFIG['files']['docx-styles'], self._CONFIG['files']['output-docx'])
-			self._doc = self._docxhelper.init()
-			self.generate_docx()
+		for gsheet, seconds, e in results:
+			if e is None:
+				info('{0} : built in {1:.3f} seconds'.format(gsheet, seconds))
+			else:
+				error('{0} : failed after {1:.3f} seconds'.format(gsheet, seconds))
 
-			self.tear_down()
+		self.tear_down()
+
+		failed = [gsheet for gsheet, seconds, e in results if e is not None]
+		if len(failed) > 0:
+			error('{0} of {1} gsheets failed : {2}'.format(len(failed), len(gsheets), ', '.join(failed)))
+			sys.exit(1)
 
 	def set_up(self):
 		# configuration
@@ -106,24 +194,71 @@ class DocxFromGsheet(object):
 		self._CONFIG['files']['docx-styles'] = os.path.abspath('{0}/{1}'.format(config_dir, self._CONFIG['files']['docx-styles']))
 		self._CONFIG['files']['docx-template'] = os.path.abspath('{0}/{1}'.format(config_dir, self._CONFIG['files']['docx-template']))
 
-		# gsheet-helper
-		self._gsheethelper = GsheetHelper()
-		self._gsheethelper.init(self._CONFIG)
+		# in a batch a gsheet that cannot be read fails its own build and the rest go on
+		self._CONFIG['exit-on-error'] = len(self._CONFIG['gsheets']) == 1
+
+		# images are resampled for their display size before they are embedded
+		self._imagepreparer = image_preparer(self._CONFIG['dirs']['temp-dir'], self._CONFIG['docx-related'])
+
+		# very large tables are streamed through files in the tmp dir, whatever a killed run left there goes
+		docx_related = self._CONFIG['docx-related']
+		clear_table_streams(os.path.abspath('{0}/streams'.format(self._CONFIG['dirs']['temp-dir'])))
+		set_render_options({'image-preparer': self._imagepreparer, 'stream-table-rows': docx_related.get('stream-table-rows', 2000), 'stream-part-rows': docx_related.get('stream-part-rows', 500), 'stream-dir': os.path.abspath('{0}/streams'.format(self._CONFIG['dirs']['temp-dir'])), 'table-engine': docx_related.get('table-engine', 'python-docx'), 'hoist-table-properties': docx_related.get('hoist-table-properties', True)})
+
+		# gsheet-helper, not needed when rendering from a snapshot
+		self._gsheethelper = None
+		if not self._from_snapshot:
+			self._gsheethelper = GsheetHelper()
+			self._gsheethelper.init(self._CONFIG)
+
+	def save_json(self, data, config):
+		with span('json-snapshot') as attrs:
+			with open(config['files']['output-json'], "w") as f:
+				f.write(json.dumps(data, sort_keys=False, indent=4, default=json_default))
+
+			attrs['bytes'] = os.path.getsize(config['files']['output-json'])
 
-	def save_json(self):
-		with open(self._CONFIG['files']['output-json'], "w") as f:
-			f.write(json.dumps(self._data, sort_keys=False, indent=4))
+	def load_json(self, config):
+		if not os.path.exists(config['files']['output-json']):
+			error('no snapshot at {0}, run without --from-snapshot first'.format(config['files']['output-json']))
+			sys.exit(1)
+
+		with span('json-snapshot-load'):
+			with open(config['files']['output-json'], "r", encoding='utf-8') as f:
+				data = json.load(f, object_hook=json_object_hook)
+
+		# the snapshot refers to downloaded images/pdfs/docx files in the tmp dir by path, they may have been cleaned up (or evicted from the media cache) since
+		missing = [path for path in referenced_files(data) if not os.path.exists(path)]
+		for path in missing:
+			warn('file {0} referred from the snapshot is missing'.format(path))
+
+		info('rendering from snapshot {0}'.format(config['files']['output-json']))
+		return data
 
 	def tear_down(self):
+		if self._imagepreparer is not None:
+			self._imagepreparer.shutdown()
+
+		if self._gsheethelper is not None:
+			self._gsheethelper.shutdown()
+
 		self.end_time = int(round(time.time() * 1000))
 		debug("Script took {} seconds".format((self.end_time - self.start_time)/1000))
+		if self._gsheethelper is not None:
+			debug("Google api retries : {}".format(self._gsheethelper.retry_stats()))
+			debug("Web requests by host : {}".format(self._gsheethelper.http_stats()))
+
+		# where the time went - the chrome trace shows every span on its thread, the table sums them up per span name
+		log_summary()
+		write_chrome_trace(os.path.abspath('{0}/trace.json'.format(self._CONFIG['dirs']['output-dir'])))
 
 if __name__ == '__main__':
 	# construct the argument parse and parse the arguments
 	ap = argparse.ArgumentParser()
 	ap.add_argument("-c", "--config", required=True, help="configuration yml path")
 	ap.add_argument("-g", "--gsheet", required=False, help="gsheet name to override gsheet list provided in configuration")
+	ap.add_argument("-s", "--from-snapshot", required=False, action='store_true', help="render from the json snapshot (<output-dir>/<gsheet>.json) of an earlier run instead of reading the gsheet")
 	args = vars(ap.parse_args())
 
-	generator = DocxFromGsheet(args["config"], args["gsheet"])
+	generator = DocxFromGsheet(args["config"], args["gsheet"], args["from_snapshot"])
 	generator.run()
@@ -7,6 +7,13 @@ from helper.docx.docx_writer import *
 from helper.docx.docx_util import *
 
 def generate(data, doc, section_specs, context):
+    # the rendered body of the section may be in the fragment cache already
+    fragments = context.get('fragment-cache')
+    fingerprint = None
+    if fragments is not None:
+        section_spec = section_specs['continuous_portrait' if data['section-break'] == '-' else data['section-break']]
+        fingerprint = fragments.fingerprint(data, section_spec)
+
     use_existing = False
     if data['section-break'] == '-':
         use_existing = True
@@ -20,6 +27,20 @@ def generate(data, doc, section_specs, context):
     else:
         debug('Writing ... {0}'.format(data['heading']).strip())
 
+    if fingerprint is not None:
+        if fragments.splice(fingerprint, doc):
+            debug('.. reused from the fragment cache')
+            return
+
+        mark = fragments.mark(doc)
+
+    render_body(data, doc, page_width, section_specs, context)
+
+    if fingerprint is not None:
+        fragments.store(fingerprint, doc, mark)
+
+def render_body(data, doc, page_width, section_specs, context):
+    # everything the section renders after its section break, parallel renderers (see helper/docx/parallel_render.py) call this on their own doc
     if data['no-heading'] == False:
         if data['level'] == 0:
             paragraph = doc.add_paragraph(data['heading'], style='HEADING1')
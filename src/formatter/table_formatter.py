@@ -4,10 +4,19 @@ import textwrap
 import importlib
 
 from helper.logger import *
+from helper.tracer import span
 from helper.docx.docx_writer import *
 from helper.docx.docx_util import *
+from helper.gsheet.worksheet_ir import Worksheet
 
 def generate(data, doc, section_specs, context):
+    # the rendered body of the section may be in the fragment cache already, sections embedding a gsheet are not cached themselves, their sections are
+    fragments = context.get('fragment-cache')
+    fingerprint = None
+    if fragments is not None and not (isinstance(data.get('contents'), dict) and 'sections' in data['contents']):
+        section_spec = section_specs['continuous_portrait' if data['section-break'] == '-' else data['section-break']]
+        fingerprint = fragments.fingerprint(data, section_spec)
+
     use_existing = False
     if data['section-break'] == '-':
         use_existing = True
@@ -21,6 +30,20 @@ def generate(data, doc, section_specs, context):
     else:
         debug('Writing ... {0}'.format(data['heading']).strip())
 
+    if fingerprint is not None:
+        if fragments.splice(fingerprint, doc):
+            debug('.. reused from the fragment cache')
+            return
+
+        mark = fragments.mark(doc)
+
+    render_body(data, doc, page_width, section_specs, context)
+
+    if fingerprint is not None:
+        fragments.store(fingerprint, doc, mark)
+
+def render_body(data, doc, page_width, section_specs, context):
+    # everything the section renders after its section break, parallel renderers (see helper/docx/parallel_render.py) call this on their own doc
     if data['no-heading'] == False:
         if data['level'] == 0:
             paragraph = doc.add_paragraph(data['heading'], style='HEADING1')
@@ -33,12 +56,12 @@ def generate(data, doc, section_specs, context):
 
     if 'contents' in data:
         if data['contents']:
-            if 'sheets' in data['contents']:
+            if isinstance(data['contents'], Worksheet):
                 # insert_content (in helper/docx/docx_writer) is our main work function
                 insert_content(data['contents'], doc, page_width, None, None)
 
             # for embedded gsheets, 'contents' does not contain the actual content to render, rather we get a list of sections where each section contains the actual content
-            elif 'sections' in data['contents']:
+            elif isinstance(data['contents'], dict) and 'sections' in data['contents']:
                 for section in data['contents']['sections']:
                     content_type = section['content-type']
 
@@ -46,4 +69,5 @@ def generate(data, doc, section_specs, context):
                     if content_type == 'gsheet': content_type = 'table'
 
                     module = importlib.import_module('formatter.{0}_formatter'.format(content_type))
-                    module.generate(section, doc, section_specs, context)
+                    with span('section', section=section['section'], heading=section['heading'], content_type=section['content-type']):
+                        module.generate(section, doc, section_specs, context)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''
+a local stand-in for the google apis, for offline runs and benchmarks of the fetch path
+
+usage:
+record real responses (needs network and a real credential) while running the generator with google-endpoint: "http://127.0.0.1:8765" in config.yml
+python google-standin.py --fixtures "../out/fixtures" --record
+
+replay them without network, with latency and errors injected
+python google-standin.py --fixtures "../out/fixtures" --latency-ms 150 --jitter-ms 100 --error-rate 0.05
+
+a service account credential that the stand-in accepts (the key is made up, google would reject it)
+python google-standin.py --fixtures "../out/fixtures" --make-credential "../conf/standin-credential.json"
+'''
+import json
+import argparse
+
+import rsa
+
+from helper.logger import *
+from helper.standin.standin_server import Standin, serve
+
+class GoogleStandin(object):
+
+	def __init__(self, fixtures_dir, port, record, latency_ms, jitter_ms, error_rate):
+		self._fixtures_dir = fixtures_dir
+		self._port = port
+		self._record = record
+		self._latency_ms = latency_ms
+		self._jitter_ms = jitter_ms
+		self._error_rate = error_rate
+
+	def make_credential(self, credential_path):
+		public_key, private_key = rsa.newkeys(2048)
+		credential = {
+			'type': 'service_account',
+			'project_id': 'standin',
+			'private_key_id': 'standin',
+			'private_key': private_key.save_pkcs1().decode('utf-8'),
+			'client_email': 'standin@standin.iam.gserviceaccount.com',
+			'client_id': '0',
+			'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+			'token_uri': 'https://oauth2.googleapis.com/token'
+		}
+		with open(credential_path, 'w', encoding='utf-8') as f:
+			json.dump(credential, f, indent=4)
+
+		info('stand-in credential written to {0}'.format(credential_path))
+
+	def run(self):
+		self._standin = Standin(self._fixtures_dir, record=self._record, latency_ms=self._latency_ms, jitter_ms=self._jitter_ms, error_rate=self._error_rate)
+		self._server = serve(self._standin, port=self._port)
+		info('google stand-in {0} {1} at http://127.0.0.1:{2}'.format('recording into' if self._record else 'replaying from', self._fixtures_dir, self._port))
+		try:
+			self._server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.tear_down()
+
+	def tear_down(self):
+		self._server.server_close()
+		debug("Stand-in requests by host : {}".format(self._standin.stats()))
+
+if __name__ == '__main__':
+	# construct the argument parse and parse the arguments
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-f", "--fixtures", required=True, help="fixture directory")
+	ap.add_argument("-p", "--port", required=False, type=int, default=8765, help="port to listen on")
+	ap.add_argument("-r", "--record", required=False, action='store_true', help="forward requests to google and record the responses")
+	ap.add_argument("--latency-ms", required=False, type=int, default=0, help="latency added to every request")
+	ap.add_argument("--jitter-ms", required=False, type=int, default=0, help="random latency (up to this) added on top of latency-ms")
+	ap.add_argument("--error-rate", required=False, type=float, default=0.0, help="fraction of requests answered with a 429 or 503")
+	ap.add_argument("--make-credential", required=False, help="write a service account credential the stand-in accepts to this path and exit")
+	args = vars(ap.parse_args())
+
+	standin = GoogleStandin(args["fixtures"], args["port"], args["record"], args["latency_ms"], args["jitter_ms"], args["error_rate"])
+	if args["make_credential"]:
+		standin.make_credential(args["make_credential"])
+	else:
+		standin.run()
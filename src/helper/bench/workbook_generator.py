@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+'''
+synthetic worksheets for benchmarking the docx renderer - the generated dicts have exactly the shape of the responses table_processor.process converts
+(a spreadsheets.get response for one worksheet, with image specs and nested 'contents' already filled in) so that worksheet_ir.Worksheet.from_dict gives
+what docx_writer.insert_content renders
+everything is drawn from a seeded random so the same parameters always generate the same worksheet
+'''
+import os
+import json
+import random
+
+from PIL import Image
+
+# the grid starts at B3 like every worksheet we fetch (see table_processor.worksheet_range)
+START_ROW = 2
+START_COLUMN = 1
+
+FONTS = ['Calibri', 'Arial', 'Cambria', 'Consolas']
+BORDER_STYLES = ['SOLID', 'SOLID_MEDIUM', 'DOTTED', 'DASHED', 'DOUBLE']
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua']
+
+# what a worksheet looks like, every key can be overridden per scenario
+DEFAULT_SHAPE = {
+    'rows': 50,
+    'cols': 6,
+    # fraction of cells that start a merge (spanning up to 3 x 3 cells)
+    'merge-density': 0.0,
+    # text runs per cell, 1 means no textFormatRuns
+    'runs': 1,
+    # how many distinct borders/backgrounds are used, 0 means none at all
+    'border-variety': 1,
+    'background-variety': 0,
+    # every nth row gets a nested worksheet (of nested-rows x nested-cols) in its second cell, 0 means none
+    'nested-every': 0,
+    'nested-rows': 5,
+    'nested-cols': 3,
+    # every nth row gets an image in its last cell, 0 means none
+    'image-every': 0,
+    # every nth row is an out-of-cell row, 0 means none
+    'out-of-cell-every': 0,
+    'words-per-cell': 6,
+    'seed': 1
+}
+
+def color(rnd):
+    return {'red': round(rnd.random(), 3), 'green': round(rnd.random(), 3), 'blue': round(rnd.random(), 3)}
+
+def text_format(rnd):
+    return {'foregroundColor': color(rnd) if rnd.random() < 0.3 else {}, 'fontFamily': rnd.choice(FONTS), 'fontSize': rnd.choice([8, 9, 10, 11, 12]), 'bold': rnd.random() < 0.2, 'italic': rnd.random() < 0.1, 'strikethrough': False, 'underline': rnd.random() < 0.05}
+
+def borders(rnd):
+    border = {'style': rnd.choice(BORDER_STYLES), 'width': rnd.choice([1, 2, 3]), 'color': color(rnd)}
+    return {'top': border, 'bottom': border, 'left': border, 'right': border}
+
+def synthetic_image(image_dir):
+    # one image is enough, the renderer does not care what is in it
+    os.makedirs(image_dir, exist_ok=True)
+    path = os.path.join(image_dir, 'synthetic.png')
+    if not os.path.exists(path):
+        Image.new('RGB', (640, 360), (200, 120, 40)).save(path, 'PNG')
+
+    return {'url': 'https://example.com/synthetic.png', 'path': path, 'height': 360, 'width': 640, 'dpi': (96, 96)}
+
+def generate_merges(rnd, rows, cols, density, blocked_rows):
+    # non-overlapping merges that stay away from out-of-cell rows, the sheet would not allow overlapping merges either
+    taken = set()
+    merges = []
+    for r in range(0, rows):
+        for c in range(0, cols):
+            if (r, c) in taken or r in blocked_rows or rnd.random() >= density:
+                continue
+
+            height, width = rnd.randint(1, 3), rnd.randint(1, 3)
+            height = min(height, rows - r)
+            width = min(width, cols - c)
+            cells = [(i, j) for i in range(r, r + height) for j in range(c, c + width)]
+            if height * width == 1 or any(cell in taken or cell[0] in blocked_rows for cell in cells):
+                continue
+
+            taken.update(cells)
+            merges.append({'sheetId': 0, 'startRowIndex': START_ROW + r, 'endRowIndex': START_ROW + r + height, 'startColumnIndex': START_COLUMN + c, 'endColumnIndex': START_COLUMN + c + width})
+
+    return merges, taken
+
+def generate_cell(rnd, shape, formats, border_set, background_set):
+    words = [rnd.choice(WORDS) for i in range(0, shape['words-per-cell'])]
+    text = ' '.join(words)
+    cell_data = {
+        'formattedValue': text,
+        'effectiveFormat': {
+            'textFormat': rnd.choice(formats),
+            'horizontalAlignment': rnd.choice(['LEFT', 'CENTER', 'RIGHT']),
+            'verticalAlignment': rnd.choice(['TOP', 'MIDDLE', 'BOTTOM']),
+            'backgroundColor': rnd.choice(background_set) if len(background_set) > 0 else {}
+        }
+    }
+
+    if len(border_set) > 0:
+        cell_data['effectiveFormat']['borders'] = rnd.choice(border_set)
+
+    if shape['runs'] > 1:
+        # runs start at word boundaries
+        starts = sorted(rnd.sample(range(1, len(words)), min(shape['runs'] - 1, len(words) - 1)))
+        offsets = [len(' '.join(words[:i])) + 1 for i in starts]
+        cell_data['textFormatRuns'] = [{'format': rnd.choice(formats)}] + [{'startIndex': offset, 'format': rnd.choice(formats)} for offset in offsets]
+
+    return cell_data
+
+def generate_worksheet(shape=None, image_dir=None, title='synthetic'):
+    '''
+        a synthetic worksheet response, shape overrides DEFAULT_SHAPE
+    '''
+    shape = {**DEFAULT_SHAPE, **(shape or {})}
+    rnd = random.Random(shape['seed'])
+    rows, cols = shape['rows'], shape['cols']
+
+    formats = [text_format(rnd) for i in range(0, 8)]
+    border_set = [borders(rnd) for i in range(0, shape['border-variety'])]
+    background_set = [color(rnd) for i in range(0, shape['background-variety'])]
+
+    out_of_cell_rows = set()
+    if shape['out-of-cell-every'] > 0:
+        out_of_cell_rows = set(range(shape['out-of-cell-every'] - 1, rows, shape['out-of-cell-every']))
+
+    merges, merged = generate_merges(rnd, rows, cols, shape['merge-density'], out_of_cell_rows)
+    anchors = set((m['startRowIndex'] - START_ROW, m['startColumnIndex'] - START_COLUMN) for m in merges)
+
+    image = None
+    if shape['image-every'] > 0:
+        image = synthetic_image(image_dir)
+
+    row_data = []
+    for r in range(0, rows):
+        values = []
+        for c in range(0, cols):
+            cell_data = generate_cell(rnd, shape, formats, border_set, background_set)
+
+            # cells covered by a merge (other than its first cell) only carry formatting
+            if (r, c) in merged and (r, c) not in anchors:
+                cell_data.pop('formattedValue')
+                cell_data.pop('textFormatRuns', None)
+
+            values.append(cell_data)
+
+        if r in out_of_cell_rows:
+            values[0]['note'] = json.dumps({'content': 'out-of-cell'})
+
+        elif shape['nested-every'] > 0 and (r + 1) % shape['nested-every'] == 0 and cols > 1:
+            nested_shape = {**shape, 'rows': shape['nested-rows'], 'cols': shape['nested-cols'], 'nested-every': 0, 'out-of-cell-every': 0, 'merge-density': 0.0, 'seed': shape['seed'] * 1000 + r}
+            values[1]['contents'] = generate_worksheet(nested_shape, image_dir, '{0}-nested-{1}'.format(title, r))
+
+        if image is not None and (r + 1) % shape['image-every'] == 0 and r not in out_of_cell_rows:
+            values[-1]['userEnteredValue'] = {'formulaValue': '=IMAGE("{0}", 3)'.format(image['url']), 'image': dict(image)}
+            values[-1].pop('formattedValue', None)
+            values[-1].pop('textFormatRuns', None)
+
+        row_data.append({'values': values})
+
+    return {
+        'spreadsheetId': 'synthetic',
+        'sheets': [{
+            'properties': {'sheetId': 0, 'title': title, 'gridProperties': {'rowCount': START_ROW + rows, 'columnCount': START_COLUMN + cols}},
+            'merges': merges,
+            'data': [{
+                'startRow': START_ROW,
+                'startColumn': START_COLUMN,
+                'rowMetadata': [{'pixelSize': 21} for r in range(0, rows)],
+                'columnMetadata': [{'pixelSize': rnd.choice([80, 100, 120, 160])} for c in range(0, cols)],
+                'rowData': row_data
+            }]
+        }]
+    }
+
+def count_cells(data):
+    # cells of a worksheet including those of the worksheets nested in it
+    count = 0
+    for row_data in data['sheets'][0]['data'][0]['rowData']:
+        for cell_data in row_data.get('values', []):
+            count = count + 1
+            if 'contents' in cell_data:
+                count = count + count_cells(cell_data['contents'])
+
+    return count
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+'''
+per-section cache of rendered body xml - a section's fingerprint is the hash of its data (fetched grid data included), the files (images, pdf pages) it
+refers to, its section spec, the styles/template files and the renderer sources. the body elements a section renders (after its section break) are kept as
+an xml fragment under that fingerprint and spliced in as they are the next time the fingerprint comes up
+
+images are kept with the fragment (by content hash) and re-added in the order they were first added, drawing ids are shifted to follow the ids already in
+the document, the character styles the section's runs refer to are added (if the document does not have them yet) in the order the section first used
+them - so that a spliced section is exactly what rendering it again would have produced
+'''
+
+import os
+import json
+import hashlib
+import threading
+
+from copy import deepcopy
+
+from lxml import etree
+
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn
+
+from helper.logger import *
+from helper.tracer import span
+from helper.docx.table_stream import has_table_streams
+from helper.docx.docx_helper import character_style, record_character_styles, recorded_character_styles
+from helper.gsheet.worksheet_ir import Worksheet, json_default
+
+# the sources that decide what a section renders to, a change in any of them invalidates every fragment
+RENDERER_SOURCES = ['formatter/table_formatter.py', 'formatter/pdf_formatter.py', 'helper/docx/docx_writer.py', 'helper/docx/docx_util.py', 'helper/docx/image_prep.py', 'helper/docx/docx_fragment.py', 'helper/docx/table_stream.py', 'helper/docx/table_builder.py', 'helper/docx/merge_index.py', 'helper/docx/docx_helper.py', 'helper/gsheet/worksheet_ir.py']
+
+# the docx-related keys that decide what a section's body renders to - stream-table-rows decides which sections are streamed (and never cached), how
+# streamed tables are cut into parts does not matter as they are not spliced. update-toc, generate-pdf, fragment-cache, render-workers and table-engine
+# leave the body as it is
+RENDERER_OPTIONS = ['prepare-images', 'image-dpi', 'image-jpeg-quality', 'image-png-to-jpeg', 'hoist-table-properties', 'stream-table-rows']
+
+def referenced_files(data):
+    # local files (images, pdfs and their page images, docx) some section data refers to
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in ['path', 'pdf_path', 'docx-path'] and isinstance(value, str):
+                yield value
+            elif key == 'images' and isinstance(value, list):
+                for path in value:
+                    if isinstance(path, str):
+                        yield path
+            else:
+                yield from referenced_files(value)
+
+    elif isinstance(data, list):
+        for value in data:
+            yield from referenced_files(value)
+
+    elif isinstance(data, Worksheet):
+        for cell_data in data.cells():
+            yield from referenced_files(cell_data.value)
+            yield from referenced_files(cell_data.contents)
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+class FragmentCache(object):
+
+    def __init__(self, root, context, reuse=True):
+        self.root = root
+        self._media_dir = os.path.join(root, 'media')
+        os.makedirs(self._media_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file_hashes = {}
+        self._used = set()
+        self._prerendered = set()
+        self.reused = 0
+        self.rendered = 0
+
+        # without reuse the store only carries fragments rendered (in parallel) for this build
+        if not reuse:
+            self.prune()
+
+        # what every fingerprint depends on
+        src_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        common = {
+            'styles': file_hash(context['files']['docx-styles']),
+            'template': file_hash(context['files']['docx-template']),
+            'renderer': [file_hash(os.path.join(src_dir, source)) for source in RENDERER_SOURCES],
+            'docx-related': {key: context['docx-related'].get(key) for key in RENDERER_OPTIONS}
+        }
+        self._common = json.dumps(common, sort_keys=True, default=str)
+
+    def media_hash(self, path):
+        # files are hashed once per run (per size and mtime), a missing file is part of the fingerprint as well
+        if not os.path.exists(path):
+            return None
+
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._file_hashes:
+                return self._file_hashes[key]
+
+        digest = file_hash(path)
+        with self._lock:
+            self._file_hashes[key] = digest
+
+        return digest
+
+    def fingerprint(self, data, section_spec):
+        h = hashlib.sha1()
+        h.update(self._common.encode('utf-8'))
+        h.update(json.dumps(section_spec, sort_keys=True, default=str).encode('utf-8'))
+        h.update(json.dumps(data, sort_keys=True, default=json_default).encode('utf-8'))
+        for path in referenced_files(data):
+            h.update('{0}:{1}'.format(path, self.media_hash(path)).encode('utf-8'))
+
+        return h.hexdigest()
+
+    def paths(self, fingerprint):
+        base = os.path.join(self.root, fingerprint)
+        return '{0}.xml'.format(base), '{0}.json'.format(base)
+
+    def cached(self, fingerprint):
+        return all(os.path.exists(path) for path in self.paths(fingerprint))
+
+    def prerendered(self, fingerprint):
+        # the fragment was rendered for this build by a parallel renderer, splicing it is not a reuse
+        self._prerendered.add(fingerprint)
+
+    def mark(self, doc):
+        # where the section's body content starts, everything after it (up to the final sectPr) is the section's - the character styles it uses are
+        # recorded from here on
+        record_character_styles(doc)
+        return len(doc.element.body) - 1
+
+    def splice(self, fingerprint, doc):
+        '''
+            appends the cached fragment of fingerprint to the document body, False if there is none
+        '''
+        xml_path, meta_path = self.paths(fingerprint)
+        if not os.path.exists(xml_path) or not os.path.exists(meta_path):
+            return False
+
+        with span('fragment-splice') as attrs:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+            if any(not os.path.exists(os.path.join(self._media_dir, image['media'])) for image in meta['images']):
+                return False
+
+            with open(xml_path, 'rb') as f:
+                fragment = parse_xml(f.read())
+
+            for format in meta['styles']:
+                character_style(doc, tuple(format[:6]) + (tuple(format[6]),))
+
+            # images are added in the order the renderer added them so that they get the same relationship ids and part names
+            rids = {}
+            for image in meta['images']:
+                rid, _ = doc.part.get_or_add_image(os.path.join(self._media_dir, image['media']))
+                rids[image['rId']] = rid
+
+            for blip in fragment.iter(qn('a:blip')):
+                blip.set(qn('r:embed'), rids[blip.get(qn('r:embed'))])
+
+            # drawing ids continue from the largest id in the document, as python-docx would have numbered them
+            doc_prs = list(fragment.iter(qn('wp:docPr')))
+            if len(doc_prs) > 0:
+                offset = doc.part.next_id - min(int(doc_pr.get('id')) for doc_pr in doc_prs)
+                for doc_pr in doc_prs:
+                    doc_pr_id = int(doc_pr.get('id'))
+                    doc_pr.set('id', str(doc_pr_id + offset))
+                    # python-docx names pictures after their id
+                    if doc_pr.get('name') == 'Picture {0}'.format(doc_pr_id):
+                        doc_pr.set('name', 'Picture {0}'.format(doc_pr_id + offset))
+
+            attrs['elements'] = len(fragment)
+            sect_pr = doc.element.body.sectPr
+            for element in list(fragment):
+                sect_pr.addprevious(element)
+
+            attrs['images'] = len(meta['images'])
+
+        self._used.add(fingerprint)
+        if fingerprint in self._prerendered:
+            self.rendered = self.rendered + 1
+        else:
+            self.reused = self.reused + 1
+
+        return True
+
+    def store(self, fingerprint, doc, mark):
+        '''
+            keeps the body elements rendered since mark as the fragment of fingerprint
+        '''
+        body = doc.element.body
+        elements = list(body)[mark:len(body) - 1]
+        styles = recorded_character_styles(doc)
+
+        # streamed tables are not in the body, only their placeholders are - such sections are rendered every time
+        if any(has_table_streams(element) for element in elements):
+            self.rendered = self.rendered + 1
+            return
+
+        fragment = OxmlElement('w:body')
+        for element in elements:
+            fragment.append(deepcopy(element))
+
+        # images in the order of their drawing ids, that is the order they were added in
+        images = []
+        seen = set()
+        doc_prs = sorted(fragment.iter(qn('wp:docPr')), key=lambda doc_pr: int(doc_pr.get('id')))
+        for doc_pr in doc_prs:
+            inline = doc_pr.getparent()
+            for blip in inline.iter(qn('a:blip')):
+                rid = blip.get(qn('r:embed'))
+                if rid in seen:
+                    continue
+
+                seen.add(rid)
+                image_part = doc.part.related_parts[rid]
+                media = '{0}.{1}'.format(image_part.sha1, image_part.partname.ext)
+                media_path = os.path.join(self._media_dir, media)
+                if not os.path.exists(media_path):
+                    self.write(media_path, image_part.blob)
+
+                images.append({'rId': rid, 'media': media})
+
+        xml_path, meta_path = self.paths(fingerprint)
+        self.write(xml_path, etree.tostring(fragment))
+        self.write(meta_path, json.dumps({'images': images, 'styles': styles}).encode('utf-8'))
+
+        self._used.add(fingerprint)
+        self.rendered = self.rendered + 1
+
+    def write(self, path, content):
+        temp_path = '{0}.{1}.part'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+
+        os.replace(temp_path, path)
+
+    def prune(self):
+        # fragments (and images) not used by this build belong to sections that have changed or are gone
+        media_in_use = set()
+        for fingerprint in self._used:
+            with open(self.paths(fingerprint)[1], 'r', encoding='utf-8') as f:
+                media_in_use.update(image['media'] for image in json.load(f)['images'])
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isfile(path) and os.path.splitext(name)[0] not in self._used:
+                os.remove(path)
+
+        for name in os.listdir(self._media_dir):
+            if name not in media_in_use:
+                os.remove(os.path.join(self._media_dir, name))
@@ -5,6 +5,9 @@ Helper to initialize and manipulate docx styles, mostly custom styles not presen
 '''
 
 import yaml
+import hashlib
+import weakref
+import threading
 
 from docx import Document
 from docx.enum.style import WD_STYLE_TYPE
@@ -13,6 +16,62 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_TAB_ALIGNMENT
 from helper.logger import *
 from helper.docx.docx_util import *
 
+# the character styles of every document (by its part), see character_style
+CHARACTER_STYLES = weakref.WeakKeyDictionary()
+_character_styles_lock = threading.Lock()
+
+# character style id by format, the id is derived from the format so that it is the same in every document (and every process)
+CHARACTER_STYLE_IDS = {}
+
+class CharacterStyles(object):
+    '''
+        the character styles generated for a document - ids of the styles it has and, while a section is being rendered for the fragment cache, the
+        styles the section uses in the order it first used them
+    '''
+
+    def __init__(self):
+        self.ids = set()
+        self.recorded = None
+
+def document_character_styles(doc):
+    with _character_styles_lock:
+        if doc.part not in CHARACTER_STYLES:
+            CHARACTER_STYLES[doc.part] = CharacterStyles()
+
+        return CHARACTER_STYLES[doc.part]
+
+def character_style(doc, format):
+    '''
+        the id of the character style having format (see docx_util.character_format), the style is added to doc when it is first asked for
+        every distinct text format becomes one style, runs refer to it instead of carrying the whole format each
+    '''
+    style_id = CHARACTER_STYLE_IDS.get(format)
+    if style_id is None:
+        style_id = 'gs-{0}'.format(hashlib.sha1(repr(format).encode('utf-8')).hexdigest()[:10])
+        CHARACTER_STYLE_IDS[format] = style_id
+
+    styles = document_character_styles(doc)
+    if style_id not in styles.ids:
+        style = doc.styles.add_style(style_id, WD_STYLE_TYPE.CHARACTER)
+        style.hidden = True
+        set_character_format(style.font, format)
+        styles.ids.add(style_id)
+
+    if styles.recorded is not None and format not in styles.recorded:
+        styles.recorded[format] = style_id
+
+    return style_id
+
+def record_character_styles(doc):
+    # starts recording the character styles doc is asked for
+    document_character_styles(doc).recorded = {}
+
+def recorded_character_styles(doc):
+    # the formats of the character styles asked for since record_character_styles, in the order they were first asked for
+    styles = document_character_styles(doc)
+    recorded, styles.recorded = styles.recorded or {}, None
+    return list(recorded.keys())
+
 class DocxHelper(object):
 
     def __init__(self, template, style, docx):
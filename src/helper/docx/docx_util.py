@@ -26,15 +26,14 @@ GSHEET_OXML_BORDER_MAPPING = {
     'NONE': 'none'
 }
 
-def set_updatefields_true(docx_path):
+def set_updatefields_true(doc):
+    # set on the doc before it is saved, reopening the saved docx for this would load the whole document again
     namespace = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
-    doc = Document(docx_path)
     # add child to doc.settings element
     element_updatefields = lxml.etree.SubElement(
         doc.settings.element, f"{namespace}updateFields"
     )
     element_updatefields.set(f"{namespace}val", "true")
-    doc.save(docx_path)
 
 '''
 Table of Contents
@@ -279,15 +278,10 @@ def rotate_text(cell: _Cell, direction: str):
     textDirection.set(qn('w:val'), direction)  # btLr tbRl
     tcPr.append(textDirection)
 
-def set_character_style(run, spec):
-    run.bold = spec['bold']
-    run.italic = spec['italic']
-    run.strike = spec['strikethrough']
-    run.underline = spec['underline']
-
-    run.font.name = spec['fontFamily']
-    run.font.size = Pt(spec['fontSize'])
-
+def character_format(spec):
+    '''
+        (bold, italic, strike, underline, font name, font size, (red, green, blue)) of a gsheet text format, what a run (or a character style) is given
+    '''
     red, green, blue = 0, 0, 0
     fgcolor = spec['foregroundColor']
     if fgcolor == {}:
@@ -297,12 +291,38 @@ def set_character_style(run, spec):
         green = int(fgcolor['green'] * 255) if 'green' in fgcolor else 0
         blue = int(fgcolor['blue'] * 255) if 'blue' in fgcolor else 0
 
-    run.font.color.rgb = RGBColor(red, green, blue)
+    return (spec['bold'], spec['italic'], spec['strikethrough'], spec['underline'], spec['fontFamily'], spec['fontSize'], (red, green, blue))
+
+def set_character_format(font, format, base_format=None):
+    # font of a run or a style, only what differs from base_format (the format of the run's character style) is set if given
+    bold, italic, strike, underline, name, size, rgb = format
+    base = base_format or (None, None, None, None, None, None, None)
+
+    if bold != base[0]: font.bold = bold
+    if italic != base[1]: font.italic = italic
+    if strike != base[2]: font.strike = strike
+    if underline != base[3]: font.underline = underline
+    if name != base[4]: font.name = name
+    if size != base[5]: font.size = Pt(size)
+    if rgb != base[6]: font.color.rgb = RGBColor(*rgb)
+
+def set_run_character_style(run, style_id, format, base_format):
+    # the run refers to its character style by id (without looking the style up) and carries only what differs from it
+    run._r.get_or_add_rPr().style = style_id
+    set_character_format(run.font, format, base_format)
+
+def set_character_style(run, spec):
+    set_character_format(run.font, character_format(spec))
 
 def set_cell_bgcolor(cell, color):
     shading_elm_1 = parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), color))
     cell._tc.get_or_add_tcPr().append(shading_elm_1)
 
+def set_table_bgcolor(table, color):
+    # shading of the whole table, cells shaded on their own are shaded over it
+    shading_elm_1 = parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), color))
+    table._tbl.tblPr.insert_element_before(shading_elm_1, 'w:tblLayout', 'w:tblCellMar', 'w:tblLook', 'w:tblCaption', 'w:tblDescription', 'w:tblPrChange')
+
 def set_paragraph_bgcolor(paragraph, color):
     shading_elm_1 = parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), color))
     paragraph._p.get_or_add_pPr().append(shading_elm_1)
@@ -360,6 +380,27 @@ def set_cell_border(cell: _Cell, **kwargs):
                 if key in edge_data:
                     element.set(qn('w:{}'.format(key)), str(edge_data[key]))
 
+def set_table_border(table, **kwargs):
+    '''
+        sets the borders of a table (top, start, bottom, end, insideH, insideV), given like those of set_cell_border - cell borders override them
+    '''
+    tblPr = table._tbl.tblPr
+    tblBorders = tblPr.first_child_found_in("w:tblBorders")
+    if tblBorders is None:
+        tblBorders = OxmlElement('w:tblBorders')
+        tblPr.insert_element_before(tblBorders, 'w:shd', 'w:tblLayout', 'w:tblCellMar', 'w:tblLook', 'w:tblCaption', 'w:tblDescription', 'w:tblPrChange')
+
+    # in schema order
+    for edge in ('top', 'start', 'bottom', 'end', 'insideH', 'insideV'):
+        edge_data = kwargs.get(edge)
+        if edge_data:
+            element = OxmlElement('w:{}'.format(edge))
+            for key in ["sz", "val", "color", "space", "shadow"]:
+                if key in edge_data:
+                    element.set(qn('w:{}'.format(key)), str(edge_data[key]))
+
+            tblBorders.append(element)
+
 def set_paragraph_border(paragraph, **kwargs):
     """
     Set paragraph's border
@@ -438,6 +479,46 @@ def ooxml_border_from_gsheet_border(borders, key):
     else:
         return None
 
+def rgb_color(color):
+    red = int(color['red'] * 255) if 'red' in color else 0
+    green = int(color['green'] * 255) if 'green' in color else 0
+    blue = int(color['blue'] * 255) if 'blue' in color else 0
+    return RGBColor(red, green, blue)
+
+class DocxFormat(object):
+    '''
+        what rendering a worksheet CellFormat into a docx needs - background, ooxml borders, character format
+    '''
+    __slots__ = ('background', 'borders', '_effective', '_text')
+
+    def __init__(self, effective):
+        bgcolor = effective.get('backgroundColor', {})
+        self.background = rgb_color(bgcolor) if bgcolor != {} else None
+
+        # keyword arguments of set_cell_border/set_paragraph_border
+        self.borders = None
+        if 'borders' in effective:
+            borders = effective['borders']
+            self.borders = {'top': ooxml_border_from_gsheet_border(borders, 'top'), 'bottom': ooxml_border_from_gsheet_border(borders, 'bottom'), 'start': ooxml_border_from_gsheet_border(borders, 'left'), 'end': ooxml_border_from_gsheet_border(borders, 'right')}
+
+        self._effective = effective
+        self._text = None
+
+    @property
+    def text(self):
+        # the character format of the text format, only cells with a value need it
+        if self._text is None:
+            self._text = character_format(self._effective['textFormat'])
+
+        return self._text
+
+def docx_format(cell_format):
+    # worked out once per (interned) format and kept with it
+    if cell_format.rendered is None:
+        cell_format.rendered = DocxFormat(cell_format.effective)
+
+    return cell_format.rendered
+
 def insert_image(cell, image_spec):
     '''
         image_spec is like {'url': url, 'path': local_path, 'height': height, 'width': width, 'dpi': im_dpi}
@@ -4,24 +4,61 @@
 various utilities for rendering gsheet cell content into a docx, mostly for Formatter of type Table
 '''
 
-import json
 import time
 import pprint
 
+from collections import Counter
+from copy import deepcopy
+
 from docx.shared import Pt, Cm, Inches, RGBColor, Emu
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_TAB_ALIGNMENT, WD_BREAK
 from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
 from docx.enum.section import WD_SECTION, WD_ORIENT
+from docx.oxml.simpletypes import ST_Merge
+from docx.oxml.ns import qn
+from docx.table import _Cell
 
 from helper.logger import *
+from helper.tracer import span
 from helper.docx.docx_util import *
+from helper.docx.docx_helper import character_style
+from helper.docx.image_prep import *
+from helper.docx.table_stream import TableStream
+from helper.docx.merge_index import MergeIndex
 
 VALIGN = {'TOP': WD_CELL_VERTICAL_ALIGNMENT.TOP, 'MIDDLE': WD_CELL_VERTICAL_ALIGNMENT.CENTER, 'BOTTOM': WD_CELL_VERTICAL_ALIGNMENT.BOTTOM}
 HALIGN = {'LEFT': WD_ALIGN_PARAGRAPH.LEFT, 'CENTER': WD_ALIGN_PARAGRAPH.CENTER, 'RIGHT': WD_ALIGN_PARAGRAPH.RIGHT, 'JUSTIFY': WD_ALIGN_PARAGRAPH.JUSTIFY}
 
-def render_content_in_cell(doc, cell, cell_data, width, r, c, start_row, start_col, merge_data, column_widths, table_spacing):
+# per run rendering options, set once before rendering starts
+# tables directly in the doc with stream-table-rows rows or more are streamed (0 means never) in parts of stream-part-rows rows, through files in stream-dir
+# table-engine is python-docx (cells are formatted through python-docx proxies) or lxml (cells are cloned from prepared elements, see table_builder.py)
+# with hoist-table-properties the borders and background most cells of a table share are set on the table once (see hoist_table_properties)
+RENDER_OPTIONS = {'image-preparer': None, 'stream-table-rows': 0, 'stream-part-rows': 500, 'stream-dir': None, 'table-engine': 'python-docx', 'hoist-table-properties': True}
+
+def set_render_options(options):
+    RENDER_OPTIONS.update(options)
+
+def table_builder(doc, table):
+    # the builder of the lxml table engine for table, None for the python-docx engine
+    if RENDER_OPTIONS['table-engine'] != 'lxml':
+        return None
+
+    from helper.docx.table_builder import TableBuilder
+    return TableBuilder(doc, table)
+
+def image_path(image, width, height):
+    # the image file to embed, prepared for its display size if an image-preparer is configured
+    if RENDER_OPTIONS['image-preparer'] is None:
+        return image['path']
+
+    return RENDER_OPTIONS['image-preparer'].path_for(image['path'], width, height)
+
+def format_cell(cell, paragraph, cell_data, width, table_spacing):
+    '''
+        sets the cell (width, alignment, background, borders ...) and paragraph properties of a cell, False if the cell has no format to apply
+    '''
+    directives = cell_data.directives
     cell.width = Inches(width)
-    paragraph = cell.paragraphs[0]
 
     # paragraph spacing
     if table_spacing == 'no-spacing':
@@ -30,251 +67,208 @@ def render_content_in_cell(doc, cell, cell_data, width, r, c, start_row, start_c
         pf.space_before = Pt(0)
         pf.space_after = Pt(0)
 
-    # handle the notes first
-    # if there is a note, see if it is a JSON, it may contain style, page-numering, new-page, keep-with-next directive etc.
-    note_json = {}
-    if 'note' in cell_data:
-        try:
-            note_json = json.loads(cell_data['note'])
-        except json.JSONDecodeError:
-            pass
-
     # process new-page
-    if 'new-page' in note_json:
+    if directives.new_page:
         # return the cell location so that the page break can be rendered later
         pf = paragraph.paragraph_format
         pf.page_break_before = True
 
     # process keep-with-next
-    if 'keep-with-next' in note_json:
+    if directives.keep_with_next:
         # return the cell location so that the page break can be rendered later
         pf = paragraph.paragraph_format
         pf.keep_with_next = True
 
-    # do some special processing if the cell_data is {}
-    if cell_data == {} or 'effectiveFormat' not in cell_data:
-        return
-
-    text_format = cell_data['effectiveFormat']['textFormat']
-    effective_format = cell_data['effectiveFormat']
+    # do some special processing if the cell has no format
+    cell_format = cell_data.format
+    if cell_format is None:
+        return False
 
     # alignments
-    cell.vertical_alignment = VALIGN[effective_format['verticalAlignment']]
-    if 'horizontalAlignment' in effective_format:
-        paragraph.alignment = HALIGN[effective_format['horizontalAlignment']]
+    cell.vertical_alignment = VALIGN[cell_format.valign]
+    if cell_format.halign is not None:
+        paragraph.alignment = HALIGN[cell_format.halign]
 
     # background color
-    bgcolor = cell_data['effectiveFormat']['backgroundColor']
-    if bgcolor != {}:
-        red = int(bgcolor['red'] * 255) if 'red' in bgcolor else 0
-        green = int(bgcolor['green'] * 255) if 'green' in bgcolor else 0
-        blue = int(bgcolor['blue'] * 255) if 'blue' in bgcolor else 0
-        set_cell_bgcolor(cell, RGBColor(red, green, blue))
+    rendered = docx_format(cell_format)
+    if rendered.background is not None:
+        set_cell_bgcolor(cell, rendered.background)
 
     # text-rotation
-    if 'textRotation' in effective_format:
-        text_rotation = effective_format['textRotation']
+    if cell_format.rotated:
         rotate_text(cell, 'btLr')
 
     # borders
-    if 'borders' in cell_data['effectiveFormat']:
-        borders = cell_data['effectiveFormat']['borders']
-        set_cell_border(cell, top=ooxml_border_from_gsheet_border(borders, 'top'), bottom=ooxml_border_from_gsheet_border(borders, 'bottom'), start=ooxml_border_from_gsheet_border(borders, 'left'), end=ooxml_border_from_gsheet_border(borders, 'right'))
+    if rendered.borders is not None:
+        set_cell_border(cell, **rendered.borders)
+
+    return True
+
+def text_runs(cell_data):
+    '''
+        [(text, character format)] of the runs the formatted value of a cell is rendered as
+    '''
+    text = cell_data.text
+    if cell_data.runs is None:
+        return [(text, docx_format(cell_data.format).text)]
+
+    text_format = cell_data.format.effective['textFormat']
+    text_runs = cell_data.runs
+    # split the text into run-texts
+    run_texts = []
+    for i in range(len(text_runs) - 1, -1, -1):
+        text_run = text_runs[i]
+        if 'startIndex' in text_run:
+            run_texts.insert(0, text[text_run['startIndex']:])
+            text = text[:text_run['startIndex']]
+        else:
+            run_texts.insert(0, text)
+
+    return [(run_texts[i], character_format({**text_format, **text_runs[i]['format']})) for i in range(0, len(text_runs))]
+
+def render_content_in_cell(doc, cell, cell_data, width, r, c, start_row, start_col, merge_index, column_widths, table_spacing):
+    paragraph = cell.paragraphs[0]
+
+    # handle the notes first
+    directives = cell_data.directives
+    if not format_cell(cell, paragraph, cell_data, width, table_spacing):
+        return
 
     # cell can be merged, so we need width after merge (in Inches)
-    cell_width = merged_cell_width(r, c, start_row, start_col, merge_data, column_widths)
+    cell_width = merged_cell_width(r, c, start_row, start_col, merge_index, column_widths)
 
     # images
-    if 'userEnteredValue' in cell_data:
-        userEnteredValue = cell_data['userEnteredValue']
-        if 'image' in userEnteredValue:
-            image = userEnteredValue['image']
-            run = paragraph.add_run()
-
-            # even now the width may exceed actual cell width, we need to adjust for that
-            # determine cell_width based on merge scenario
-            dpi_x = 150 if image['dpi'][0] == 0 else image['dpi'][0]
-            dpi_y = 150 if image['dpi'][1] == 0 else image['dpi'][1]
-            image_width = image['width'] / dpi_x
-            image_height = image['height'] / dpi_y
-            if image_width > cell_width:
-                adjust_ratio = (cell_width / image_width)
-                # keep a padding of 0.1 inch
-                image_width = cell_width - 0.2
-                image_height = image_height * adjust_ratio
-
-            run.add_picture(image['path'], height=Inches(image_height), width=Inches(image_width))
+    image = cell_data.image
+    if image is not None:
+        run = paragraph.add_run()
+
+        # even now the width may exceed actual cell width, we need to adjust for that
+        # determine cell_width based on merge scenario
+        image_width, image_height = display_size(image, cell_width)
+        run.add_picture(image_path(image, image_width, image_height), height=Inches(image_height), width=Inches(image_width))
 
     # before rendering cell, see if it embeds another worksheet
-    if 'contents' in cell_data:
-        table = insert_content(cell_data['contents'], doc, cell_width, container=None, cell=cell)
+    if cell_data.contents is not None:
+        table = insert_content(cell_data.contents, doc, cell_width, container=None, cell=cell)
         # polish_table(table)
         return
 
     # texts
-    if 'formattedValue' not in cell_data:
+    if cell_data.text is None:
         return
 
-    text = cell_data['formattedValue']
+    text = cell_data.text
 
     # process notes
     # note specifies style
-    if 'style' in note_json:
+    if directives.style is not None:
         paragraph.add_run(text)
-        paragraph.style = note_json['style']
+        paragraph.style = directives.style
         return
 
     # note specifies page numbering
-    if 'page-number' in note_json:
+    if directives.page_number is not None:
         append_page_number_with_pages(paragraph)
         #append_page_number_only(paragraph)
-        paragraph.style = note_json['page-number']
+        paragraph.style = directives.page_number
         return
 
-    # finally cell content, add runs
-    if 'textFormatRuns' in cell_data:
-        text_runs = cell_data['textFormatRuns']
-        # split the text into run-texts
-        run_texts = []
-        for i in range(len(text_runs) - 1, -1, -1):
-            text_run = text_runs[i]
-            if 'startIndex' in text_run:
-                run_texts.insert(0, text[text_run['startIndex']:])
-                text = text[:text_run['startIndex']]
-            else:
-                run_texts.insert(0, text)
-
-        # now render runs
-        for i in range(0, len(text_runs)):
-            # get formatting
-            format = text_runs[i]['format']
-
-            run = paragraph.add_run(run_texts[i])
-            set_character_style(run, {**text_format, **format})
-    else:
-        run = paragraph.add_run(text)
-        set_character_style(run, text_format)
+    # finally cell content, add runs - they refer to the character style of the cell's text format and carry what differs from it
+    base_format = docx_format(cell_data.format).text
+    style_id = character_style(doc, base_format)
+    for run_text, format in text_runs(cell_data):
+        run = paragraph.add_run(run_text)
+        set_run_character_style(run, style_id, format, base_format)
 
 
 def render_content_in_doc(doc, cell_data):
     paragraph = doc.add_paragraph()
 
     # handle the notes first
-    # if there is a note, see if it is a JSON, it may contain style, page-numering, new-page, keep-with-next directive etc.
-    note_json = {}
-    if 'note' in cell_data:
-        try:
-            note_json = json.loads(cell_data['note'])
-        except json.JSONDecodeError:
-            pass
+    directives = cell_data.directives
 
     # process new-page
-    if 'new-page' in note_json:
+    if directives.new_page:
         # return the cell location so that the page break can be rendered later
         pf = paragraph.paragraph_format
         pf.page_break_before = True
 
     # process keep-with-next
-    if 'keep-with-next' in note_json:
+    if directives.keep_with_next:
         # return the cell location so that the page break can be rendered later
         pf = paragraph.paragraph_format
         pf.keep_with_next = True
 
-    # do some special processing if the cell_data is {}
-    if cell_data == {} or 'effectiveFormat' not in cell_data:
+    # do some special processing if the cell has no format
+    cell_format = cell_data.format
+    if cell_format is None:
         return
 
-    text_format = cell_data['effectiveFormat']['textFormat']
-    effective_format = cell_data['effectiveFormat']
-
     # alignments
-    # cell.vertical_alignment = VALIGN[effective_format['verticalAlignment']]
-    if 'horizontalAlignment' in effective_format:
-        paragraph.alignment = HALIGN[effective_format['horizontalAlignment']]
+    # cell.vertical_alignment = VALIGN[cell_format.valign]
+    if cell_format.halign is not None:
+        paragraph.alignment = HALIGN[cell_format.halign]
 
     # borders
-    if 'borders' in cell_data['effectiveFormat']:
-        borders = cell_data['effectiveFormat']['borders']
-        set_paragraph_border(paragraph, top=ooxml_border_from_gsheet_border(borders, 'top'), bottom=ooxml_border_from_gsheet_border(borders, 'bottom'), start=ooxml_border_from_gsheet_border(borders, 'left'), end=ooxml_border_from_gsheet_border(borders, 'right'))
+    rendered = docx_format(cell_format)
+    if rendered.borders is not None:
+        set_paragraph_border(paragraph, **rendered.borders)
 
     # background color
-    bgcolor = cell_data['effectiveFormat']['backgroundColor']
-    if bgcolor != {}:
-        red = int(bgcolor['red'] * 255) if 'red' in bgcolor else 0
-        green = int(bgcolor['green'] * 255) if 'green' in bgcolor else 0
-        blue = int(bgcolor['blue'] * 255) if 'blue' in bgcolor else 0
-        set_paragraph_bgcolor(paragraph, RGBColor(red, green, blue))
+    if rendered.background is not None:
+        set_paragraph_bgcolor(paragraph, rendered.background)
 
     # images
-    if 'userEnteredValue' in cell_data:
-        userEnteredValue = cell_data['userEnteredValue']
-        if 'image' in userEnteredValue:
-            image = userEnteredValue['image']
-            run = paragraph.add_run()
-
-            # even now the width may exceed actual cell width, we need to adjust for that
-            # determine cell_width based on merge scenario
-            dpi_x = 150 if image['dpi'][0] == 0 else image['dpi'][0]
-            dpi_y = 150 if image['dpi'][1] == 0 else image['dpi'][1]
-            image_width = image['width'] / dpi_x
-            image_height = image['height'] / dpi_y
-            if image_width > cell_width:
-                adjust_ratio = (cell_width / image_width)
-                # keep a padding of 0.1 inch
-                image_width = cell_width - 0.2
-                image_height = image_height * adjust_ratio
-
-            run.add_picture(image['path'], height=Inches(image_height), width=Inches(image_width))
+    image = cell_data.image
+    if image is not None:
+        run = paragraph.add_run()
+
+        # even now the width may exceed actual cell width, we need to adjust for that
+        # determine cell_width based on merge scenario
+        dpi_x = 150 if image['dpi'][0] == 0 else image['dpi'][0]
+        dpi_y = 150 if image['dpi'][1] == 0 else image['dpi'][1]
+        image_width = image['width'] / dpi_x
+        image_height = image['height'] / dpi_y
+        if image_width > cell_width:
+            adjust_ratio = (cell_width / image_width)
+            # keep a padding of 0.1 inch
+            image_width = cell_width - 0.2
+            image_height = image_height * adjust_ratio
+
+        run.add_picture(image['path'], height=Inches(image_height), width=Inches(image_width))
 
     # before rendering cell, see if it embeds another worksheet
-    if 'contents' in cell_data:
-        table = insert_content(cell_data['contents'], doc, cell_width, container=None, cell=cell)
+    if cell_data.contents is not None:
+        table = insert_content(cell_data.contents, doc, cell_width, container=None, cell=cell)
         # polish_table(table)
         return
 
     # texts
-    if 'formattedValue' not in cell_data:
+    if cell_data.text is None:
         return
 
-    text = cell_data['formattedValue']
+    text = cell_data.text
 
     # process notes
     # note specifies style
-    if 'style' in note_json:
+    if directives.style is not None:
         paragraph.add_run(text)
-        paragraph.style = note_json['style']
+        paragraph.style = directives.style
         return
 
     # note specifies page numbering
-    if 'page-number' in note_json:
+    if directives.page_number is not None:
         append_page_number_with_pages(paragraph)
         #append_page_number_only(paragraph)
-        paragraph.style = note_json['page-number']
+        paragraph.style = directives.page_number
         return
 
     # finally cell content, add runs
-    if 'textFormatRuns' in cell_data:
-        text_runs = cell_data['textFormatRuns']
-        # split the text into run-texts
-        run_texts = []
-        for i in range(len(text_runs) - 1, -1, -1):
-            text_run = text_runs[i]
-            if 'startIndex' in text_run:
-                run_texts.insert(0, text[text_run['startIndex']:])
-                text = text[:text_run['startIndex']]
-            else:
-                run_texts.insert(0, text)
-
-        # now render runs
-        for i in range(0, len(text_runs)):
-            # get formatting
-            format = text_runs[i]['format']
-
-            run = paragraph.add_run(run_texts[i])
-            set_character_style(run, {**text_format, **format})
-    else:
-        run = paragraph.add_run(text)
-        set_character_style(run, text_format)
+    base_format = rendered.text
+    style_id = character_style(doc, base_format)
+    for run_text, format in text_runs(cell_data):
+        run = paragraph.add_run(run_text)
+        set_run_character_style(run, style_id, format, base_format)
 
 
 def insert_content(data, doc, container_width, container=None, cell=None, repeat_rows=0):
@@ -289,78 +283,31 @@ def insert_content(data, doc, container_width, container=None, cell=None, repeat
     # if we have such a content, anything prior to this content will go in one table, the out-of-cell content will go into the document and subsequent cells will go into another table after the put-of-cell content
     # we basically need content segmentation/segrefation into parts
 
-    start_row, start_col = data['sheets'][0]['data'][0]['startRow'], data['sheets'][0]['data'][0]['startColumn']
-    worksheet_rows = data['sheets'][0]['properties']['gridProperties']['rowCount']
-    worksheet_cols = data['sheets'][0]['properties']['gridProperties']['columnCount']
-
-    row_data = data['sheets'][0]['data'][0]['rowData']
-    out_of_cell_content_rows = []
-    # we are looking for out-of-cell content
-    for row_num in range(start_row + 1, worksheet_rows + 1):
-        # we look only in the first column
-        # debug('at row : {0}/{1}'.format(row_num, worksheet_rows))
-        row_data_index = row_num - start_row - 1
-
-        # get the first cell notes
-        first_cell_data = row_data[row_data_index]['values'][0]
-        first_cell_note_json = {}
-        if 'note' in first_cell_data:
-            try:
-                first_cell_note_json = json.loads(first_cell_data['note'])
-            except json.JSONDecodeError:
-                pass
-
-        # see the 'content' tag
-        out_of_cell_content = False
-        if 'content' in first_cell_note_json:
-            if first_cell_note_json['content'] == 'out-of-cell':
-                out_of_cell_content = True
-
-        # if content is out of cell, mark the row
-        if out_of_cell_content:
-            out_of_cell_content_rows.append(row_num)
-
-    # we have found all rows which are to be rendered out-of-cell that is directly into the doc, not inside any existing table cell
-    # now we have to segment the rows into table segments and out-of-cell segments
-    start_at_row = start_row + 1
-    row_segments = []
-    for row_num in out_of_cell_content_rows:
-        if row_num > start_at_row:
-            row_segments.append({'table': (start_at_row, row_num - 1)})
-
-        row_segments.append({'no-table': (row_num, row_num)})
-        start_at_row = row_num + 1
-
-    # there may be trailing rows after the last out-of-cell content row, they will merge into a table
-    if start_at_row <= worksheet_rows:
-        row_segments.append({'table': (start_at_row, worksheet_rows)})
-
-    # we have got the segments, now we render them - if table, we render as table, if no-table, we render into the doc
-    segment_count = 0
-    for row_segment in row_segments:
-        segment_count = segment_count + 1
-        if 'table' in row_segment:
-            # debug('table segment {0}/{1} : spanning rows [{2}:{3}]'.format(segment_count, len(row_segments), row_segment['table'][0], row_segment['table'][1]))
-            insert_content_as_table(data=data, doc=doc, start_row=start_row, start_col=start_col, row_from=row_segment['table'][0], row_to=row_segment['table'][1], container_width=container_width, container=container, cell=cell, repeat_rows=repeat_rows)
-        elif 'no-table' in row_segment:
-            # debug('no-table segment {0}/{1} : at row [{2}]'.format(segment_count, len(row_segments), row_segment['no-table'][0]))
-            insert_content_into_doc(data=data, doc=doc, start_row=start_row, row_from=row_segment['no-table'][0], container_width=container_width)
+    # the worksheet is segmented into table and out-of-cell segments already (see worksheet_ir.Worksheet.row_segments), now we render them - if table, we
+    # render as table, if no-table, we render into the doc
+    start_row, start_col = data.start_row, data.start_col
+    for segment_type, row_from, row_to in data.segments:
+        if segment_type == 'table':
+            # debug('table segment : spanning rows [{0}:{1}]'.format(row_from, row_to))
+            insert_content_as_table(data=data, doc=doc, start_row=start_row, start_col=start_col, row_from=row_from, row_to=row_to, container_width=container_width, container=container, cell=cell, repeat_rows=repeat_rows)
+        elif segment_type == 'no-table':
+            # debug('no-table segment : at row [{0}]'.format(row_from))
+            insert_content_into_doc(data=data, doc=doc, start_row=start_row, row_from=row_from, container_width=container_width)
         else:
             warn('something unsual happened - unknown row segment type')
 
 
 def insert_content_into_doc(data, doc, start_row, row_from, container_width):
     # the content is by default one row content and we are only interested in the first column value
-    row_data = data['sheets'][0]['data'][0]['rowData']
-    first_cell_data = row_data[row_from - (start_row + 1)]['values'][0]
+    first_cell_data = data.first_cell(row_from)
 
     # thre may be two cases
     # the value may have a 'contents' object in which case we call insert_content
-    if 'contents' in first_cell_data:
+    if first_cell_data.contents is not None:
         # Hack: we put a blank small-height paragraph so that it does not get merged with any previous table
         paragraph = doc.add_paragraph()
         paragraph.style = 'Calibri-2-Gray8'
-        insert_content(first_cell_data['contents'], doc, container_width, container=None, cell=None)
+        insert_content(first_cell_data.contents, doc, container_width, container=None, cell=None)
         # polish_table(table)
 
     # or it may be anything else
@@ -375,14 +322,23 @@ def insert_content_as_table(data, doc, start_row, start_col, row_from, row_to, c
 
     # calculate table dimension
     table_rows = row_to - row_from + 1
-    table_cols = data['sheets'][0]['properties']['gridProperties']['columnCount'] - start_col
+    table_cols = data.col_count - start_col
 
     merge_data = {}
-    if 'merges' in data['sheets'][0]:
-        merge_data = data['sheets'][0]['merges']
+    if data.merges is not None:
+        merge_data = data.merges
+
+    # merges are looked up through an index built once for the table
+    merge_index = MergeIndex(merge_data, start_row, start_col, row_from, row_to, table_cols)
+
+    # very large tables directly in the doc are streamed, they are rendered a few hundred rows at a time and written out (see table_stream.py)
+    streamed = container is None and cell is None and RENDER_OPTIONS['stream-table-rows'] > 0 and table_rows >= RENDER_OPTIONS['stream-table-rows']
 
     # create the table
-    if container is not None:
+    if streamed:
+        table = None
+
+    elif container is not None:
         table = container.add_table(table_rows, table_cols, Pt(container_width))
 
 	# table to be added inside a cell
@@ -396,18 +352,18 @@ def insert_content_as_table(data, doc, start_row, start_col, row_from, row_to, c
         table = doc.add_table(table_rows, table_cols)
 
     # resize columns as per data
-    column_data = data['sheets'][0]['data'][0]['columnMetadata']
+    column_data = data.column_metadata
     total_width = sum(x['pixelSize'] for x in column_data)
     column_widths = [ (x['pixelSize'] * container_width / total_width) for x in column_data ]
 
     # if the table had too many columns, use a style where there is smaller left, right margin
-    if len(column_widths) > 10:
+    if len(column_widths) > 10 and table is not None:
         table.style = 'PlainTable'
 
     last_time = current_time
 
     # populate cells
-    # total_rows = len(data['sheets'][0]['data'][0]['rowData'])
+    # total_rows = len(data.rows)
     total_rows = table_rows
     i = 0
     current_time = int(round(time.time() * 1000))
@@ -419,49 +375,44 @@ def insert_content_as_table(data, doc, start_row, start_col, row_from, row_to, c
     # table-spacing - no-spacing means cell paragraphs must not have any spacing throughout the table, useful for source code rendering
     # table-header-rows - number of header rows to repeat across pages (NOT IMPLEMENTED YET)
 
-    row_data = data['sheets'][0]['data'][0]['rowData']
+    row_data = data.rows
 
-    # get the first cell notes
-    # if there is a note, see if it is a JSON, it may contain table specific styling directives
-    first_cell_data = row_data[row_from - (start_row + 1)]['values'][0]
-    first_cell_note_json = {}
-    if 'note' in first_cell_data:
-        try:
-            first_cell_note_json = json.loads(first_cell_data['note'])
-        except json.JSONDecodeError:
-            pass
+    # get the first cell notes, they may contain table specific styling directives
+    first_cell_directives = data.first_cell(row_from).directives
 
     # handle table-spacing in notes, if the value is no-spacing then all cell paragraphs must have no spacing
-    if 'table-spacing' in first_cell_note_json:
-        table_spacing = first_cell_note_json['table-spacing']
-        # debug('table-spacing is [{0}]'.format(table_spacing))
-    else:
-        table_spacing = ''
+    table_spacing = first_cell_directives.table_spacing
 
-    repeating_row_count = 0
     # handle repeat-rows directive. The value is an integer telling us how many rows (from the first row) should be repeated in pages for this table
-    if 'repeat-rows' in first_cell_note_json:
-        repeating_row_count = int(first_cell_note_json['repeat-rows'])
-        # debug('repeat-rows is [{0}]'.format(repeating_row_count))
-    else:
-        repeating_row_count = 0
+    repeating_row_count = first_cell_directives.repeat_rows
 
-    table_row_index = 0
-    for data_row_index in range(row_from - (start_row + 1), row_to - (start_row + 0)):
-        if 'values' in row_data[data_row_index]:
-            row = table.row_cells(table_row_index)
-            row_values = row_data[data_row_index]['values']
+    # images of the whole table are prepared (resampled for their display size) together before the cells are rendered
+    if RENDER_OPTIONS['image-preparer'] is not None:
+        images = []
+        for data_row_index in range(row_from - (start_row + 1), row_to - (start_row + 0)):
+            for c, cell_data in enumerate(row_data[data_row_index] or []):
+                image = cell_data.image
+                if image is not None:
+                    image_width, image_height = display_size(image, merged_cell_width(data_row_index, c, start_row, start_col, merge_index, column_widths))
+                    images.append((image['path'], image_width, image_height))
 
-            for c in range(0, len(row_values)):
-                # render_content_in_cell () is the main work function for rendering an individual cell (eg., gsheet cell -> docx table cell)
-                render_content_in_cell(doc, row[c], row_values[c], column_widths[c], data_row_index, c, start_row, start_col, merge_data, column_widths, table_spacing)
+        RENDER_OPTIONS['image-preparer'].prepare(images)
 
-            if table_row_index % 100 == 0:
-                current_time = int(round(time.time() * 1000))
-                if not container: info('  .... cell rendered for {0}/{1} rows : {2} ms'.format(table_row_index, total_rows, current_time - last_time))
-                last_time = current_time
+    # borders and background to set on the table instead of on (most of) its cells
+    table_borders, table_background = None, None
+    if RENDER_OPTIONS['hoist-table-properties']:
+        table_borders, table_background = hoisted_properties(row_data, row_from - (start_row + 1), table_rows, table_cols)
 
-        table_row_index = table_row_index + 1
+    if streamed:
+        insert_table_stream(data, doc, start_row, start_col, row_from, row_to, table_cols, merge_index, column_widths, table_spacing, repeating_row_count, table_borders, table_background)
+
+        current_time = int(round(time.time() * 1000))
+        info('.. content insertion completed : {0} ms\n'.format(current_time - start_time))
+        return None
+
+    builder = table_builder(doc, table)
+    with span('table-render', rows=table_rows, cols=table_cols, nested=cell is not None, engine=RENDER_OPTIONS['table-engine']):
+        render_table_rows(doc, table, row_data, row_from - (start_row + 1), 0, table_rows, start_row, start_col, merge_index, column_widths, table_spacing, log=not container, builder=builder)
 
     current_time = int(round(time.time() * 1000))
     if not container: info('  .. rendering cell complete for {0} rows : {1} ms\n'.format(total_rows, current_time - start_time))
@@ -469,29 +420,10 @@ def insert_content_as_table(data, doc, start_row, start_col, row_from, row_to, c
 
     # merge cells according to data
     if not container: info('  .. merging cells'.format(current_time - last_time))
-    for m in merge_data:
-        # check if the merge is applicable for this table's rows
-        if m['startRowIndex'] < (row_from - 1) or m['endRowIndex'] > (row_to):
-            continue
-
-        start_row_index = m['startRowIndex'] - (row_from - start_row) - 1
-        end_row_index = m['endRowIndex'] - (row_from - start_row) - 2
-
-        start_column_index = m['startColumnIndex'] - start_col
-        end_column_index = m['endColumnIndex'] - start_col - 1
-        # debug('merging cell ({0}, {1}) with cell ({2}, {3})'.format(start_row_index, start_column_index, end_row_index, end_column_index))
-        starting_cell = table.cell(start_row_index, start_column_index)
-
-        # all cells within the merge range need to have the same border as the first cell
-        for r in range(start_row_index, end_row_index + 1):
-            for c in range(start_column_index, end_column_index + 1):
-                if (r, c) != (start_row_index, start_column_index):
-                    to_cell = table.cell(r, c)
-                    # TODO: copy border to all cells
-                    copy_cell_border(starting_cell, to_cell)
+    with span('table-merge', merges=len(merge_index)):
+        merge_table_cells(table, merge_index)
 
-        ending_cell = table.cell(end_row_index, end_column_index)
-        starting_cell.merge(ending_cell)
+    hoist_table_properties(table, table_borders, table_background)
 
     # handle repeat_rows
     for r in range(0, repeating_row_count):
@@ -507,12 +439,314 @@ def insert_content_as_table(data, doc, start_row, start_col, row_from, row_to, c
     return table
 
 
-def merged_cell_width(row, col, start_row, start_col, merges, column_widths):
+def render_table_rows(doc, table, row_data, data_row_from, table_row_from, row_count, start_row, start_col, merge_index, column_widths, table_spacing, log=True, builder=None):
+    '''
+        renders row_count data rows (from data_row_from) into the rows of table (from table_row_from), through builder if the lxml engine is used
+    '''
+    if builder is not None:
+        builder.render_rows(row_data, data_row_from, table_row_from, row_count, start_row, start_col, merge_index, column_widths, table_spacing, log=log)
+        return
+
+    last_time = int(round(time.time() * 1000))
+    table_row_index = table_row_from
+    for data_row_index in range(data_row_from, data_row_from + row_count):
+        row_values = row_data[data_row_index]
+        if row_values is not None:
+            row = table.row_cells(table_row_index)
+
+            for c in range(0, len(row_values)):
+                # render_content_in_cell () is the main work function for rendering an individual cell (eg., gsheet cell -> docx table cell)
+                render_content_in_cell(doc, row[c], row_values[c], column_widths[c], data_row_index, c, start_row, start_col, merge_index, column_widths, table_spacing)
+
+            if table_row_index % 100 == 0:
+                current_time = int(round(time.time() * 1000))
+                if log: info('  .... cell rendered for {0}/{1} rows : {2} ms'.format(table_row_index, table_row_from + row_count, current_time - last_time))
+                last_time = current_time
+
+        table_row_index = table_row_index + 1
+
+
+def merge_table_cells(table, merge_index, part_from=0, part_to=None):
+    '''
+        applies the merges of merge_index within table rows part_from..part_to to table, whose first row is part_from (a part of a streamed table)
+        the tc elements are read once and merged the way _Cell.merge does, without looking every cell up through the table
+    '''
+    tc_rows = [tr.tc_lst for tr in table._tbl.tr_lst]
+    for start_row_index, start_column_index, end_row_index, end_column_index in merge_index.merges(part_from, part_to):
+        # debug('merging cell ({0}, {1}) with cell ({2}, {3})'.format(start_row_index, start_column_index, end_row_index, end_column_index))
+        top_tc = tc_rows[start_row_index][start_column_index]
+        starting_cell = _Cell(top_tc, table)
+
+        # all cells within the merge range need to have the same border as the first cell
+        for r in range(start_row_index, end_row_index + 1):
+            for c in range(start_column_index, end_column_index + 1):
+                if (r, c) != (start_row_index, start_column_index):
+                    copy_cell_border(starting_cell, _Cell(tc_rows[r][c], table))
+
+        # the first tc of every row spans the merged columns (their content moves to the top cell), the rows below the first continue the top one
+        width = end_column_index - start_column_index + 1
+        height = end_row_index - start_row_index + 1
+        for r in range(start_row_index, end_row_index + 1):
+            if height == 1:
+                v_merge = None
+            elif r == start_row_index:
+                v_merge = ST_Merge.RESTART
+            else:
+                v_merge = ST_Merge.CONTINUE
+
+            tc_rows[r][start_column_index]._span_to_width(width, top_tc, v_merge)
+
+
+def insert_table_stream(data, doc, start_row, start_col, row_from, row_to, table_cols, merge_index, column_widths, table_spacing, repeating_row_count, table_borders=None, table_background=None):
+    '''
+        renders a table directly in the doc in parts of (about) stream-part-rows rows, every part is rendered as a table of its own exactly the way a whole
+        table is and its rows are written out to the stream - parts never cut through a merge so that merges are applied the same way as well
+    '''
+    table_rows = row_to - row_from + 1
+    part_rows = RENDER_OPTIONS['stream-part-rows']
+
+    info('  .. streaming {0} rows in parts of {1}'.format(table_rows, part_rows))
+    row_data = data.rows
+    stream = TableStream(doc, RENDER_OPTIONS['stream-dir'])
+    try:
+        with span('table-stream', rows=table_rows, cols=table_cols) as attrs:
+            part_from = 0
+            parts = 0
+            pending, pending_from, above = None, 0, None
+            while part_from < table_rows:
+                part_to = min(part_from + part_rows, table_rows) - 1
+                # a row a merge continues below may not end a part
+                while merge_index.continued(part_to):
+                    part_to = part_to + 1
+
+                # the part as the rows of a table of its own, worksheet rows row_from + part_from .. row_from + part_to
+                part_table = doc.add_table(part_to - part_from + 1, table_cols)
+                if len(column_widths) > 10:
+                    part_table.style = 'PlainTable'
+
+                builder = table_builder(doc, part_table)
+                render_table_rows(doc, part_table, row_data, row_from - (start_row + 1) + part_from, 0, part_to - part_from + 1, start_row, start_col, merge_index, column_widths, table_spacing, log=False, builder=builder)
+                merge_table_cells(part_table, merge_index, part_from, part_to)
+
+                for r in range(part_from, min(part_to + 1, repeating_row_count)):
+                    set_repeat_table_header(part_table.rows[r - part_from])
+
+                # a part is written once the next one is rendered, hoisting compares the borders of the cells on both sides of the edge between them
+                if pending is not None:
+                    above = write_table_part(stream, pending, pending_from, table_rows, table_borders, table_background, above, part_table._tbl.tr_lst[0])
+
+                pending, pending_from = part_table, part_from
+                parts = parts + 1
+                info('  .... streamed {0}/{1} rows'.format(part_to + 1, table_rows))
+                part_from = part_to + 1
+
+            if pending is not None:
+                write_table_part(stream, pending, pending_from, table_rows, table_borders, table_background, above, None)
+
+            stream.close()
+            attrs['parts'] = parts
+            attrs['bytes'] = stream.size
+    except BaseException:
+        # a table that could not be rendered leaves no stream file behind
+        stream.discard()
+        raise
+
+
+def hoisted_properties(row_data, data_row_from, row_count, cols):
+    '''
+        (borders by table edge, background) most cells of the table of row_count data rows (from data_row_from) share, they are set on the table once and
+        cells having them do not carry them where the table's do the same (see hoist_table_properties). a cell without a border (or background) of its own would show the one
+        set on the table instead of what the table style gives, so borders are only hoisted if every cell has all four and the background if every cell has one
+    '''
+    # cell sides are counted by (format, side) per table edge, borders of a format are worked out already
+    sides = {'top': Counter(), 'start': Counter(), 'bottom': Counter(), 'end': Counter(), 'insideH': Counter(), 'insideV': Counter()}
+    backgrounds = Counter()
+    bordered, shaded = True, True
+    for r in range(0, row_count):
+        row_values = row_data[data_row_from + r]
+        if row_values is None or len(row_values) < cols:
+            return None, None
+
+        for c in range(0, cols):
+            cell_format = row_values[c].format
+            if cell_format is None:
+                return None, None
+
+            rendered = docx_format(cell_format)
+            if bordered and (rendered.borders is None or None in rendered.borders.values()):
+                bordered = False
+
+            if bordered:
+                sides['top' if r == 0 else 'insideH'][cell_format, 'top'] += 1
+                sides['bottom' if r == row_count - 1 else 'insideH'][cell_format, 'bottom'] += 1
+                sides['start' if c == 0 else 'insideV'][cell_format, 'start'] += 1
+                sides['end' if c == cols - 1 else 'insideV'][cell_format, 'end'] += 1
+
+            if shaded and rendered.background is None:
+                shaded = False
+
+            if shaded:
+                backgrounds[rendered.background] += 1
+
+            if not bordered and not shaded:
+                return None, None
+
+    table_borders = None
+    if bordered:
+        table_borders = {}
+        for edge, counter in sides.items():
+            borders = Counter()
+            for (cell_format, side), count in counter.items():
+                borders[tuple(docx_format(cell_format).borders[side].items())] += count
+
+            # a table of one row has no insideH, of one column no insideV
+            if len(borders) > 0:
+                table_borders[edge] = dict(borders.most_common(1)[0][0])
+
+    table_background = backgrounds.most_common(1)[0][0] if shaded else None
+    return table_borders, table_background
+
+
+# cell sides by the tags set_cell_border gives them, and the side of a neighbour a cell side faces
+BORDER_SIDES = {qn('w:top'): 'top', qn('w:bottom'): 'bottom', qn('w:start'): 'start', qn('w:end'): 'end'}
+FACING = {'top': 'bottom', 'bottom': 'top', 'start': 'end', 'end': 'start'}
+
+def row_borders(tr):
+    '''
+        [(tc, grid column, grid span, {side: (border element, its attributes)})] of the cells of tr, the attributes are copied so that they stay what they
+        were while borders are removed
+    '''
+    cells = []
+    c = 0
+    for tc in tr.tc_lst:
+        grid_span = tc.grid_span
+        sides = {}
+        tcPr = tc.tcPr
+        tcBorders = tcPr.find(qn('w:tcBorders')) if tcPr is not None else None
+        if tcBorders is not None:
+            for element in tcBorders:
+                side = BORDER_SIDES.get(element.tag)
+                if side is not None:
+                    sides[side] = (element, dict(element.attrib))
+
+        cells.append((tc, c, grid_span, sides))
+        c = c + grid_span
+
+    return cells
+
+def facing_borders(cells, c, grid_span, side):
+    '''
+        ([border attributes], vertically merged) of side of the cells of a row (see row_borders) over grid columns c .. c + grid_span - 1 - a cell without
+        the side has None, a row not known has no borders
+    '''
+    borders, merged = [], False
+    if cells is None:
+        return borders, merged
+
+    for tc, col, span, sides in cells:
+        if col < c + grid_span and col + span > c:
+            border = sides.get(side)
+            borders.append(border[1] if border is not None else None)
+            merged = merged or tc.vMerge is not None
+
+    return borders, merged
+
+def hoist_table_properties(table, table_borders, table_background, row_from=0, row_count=None, above=None, below=None):
+    '''
+        sets table_borders and table_background on table and removes them from the cells having them - table may be the rows from row_from of a table of
+        row_count rows (a part of a streamed table), the edges of a cell are those of the whole table and above/below are the rows (as they were before
+        hoisting) next to the part
+
+        a border a cell has wins over the table's, so an edge shared by two cells loses its cell borders only where they would not decide it differently:
+        - an outer edge having the table's border goes
+        - a shared edge goes on both cells if both sides have the table's border
+        - a shared edge both sides of which have the same border stays on the earlier cell (bottom/end) only - unless it is vertically merged, which side
+          of a merge Word takes is not for us to guess
+        any other edge stays on both cells, their borders compete as they did
+    '''
+    if table_borders is None and table_background is None:
+        return
+
+    tbl = table._tbl
+    if row_count is None:
+        row_count = len(tbl.tr_lst)
+
+    cols = len(tbl.tblGrid.gridCol_lst)
+    if table_borders is not None:
+        set_table_border(table, **table_borders)
+        # as set_cell_border sets the attributes of an edge
+        table_borders = {edge: {qn('w:{}'.format(key)): str(border[key]) for key in ["sz", "val", "color", "space", "shadow"] if key in border} for edge, border in table_borders.items()}
+
+    if table_background is not None:
+        set_table_bgcolor(table, table_background)
+        table_background = str(table_background)
+
+    rows = [row_borders(tr) for tr in tbl.tr_lst]
+    above_cells = row_borders(above) if above is not None else None
+    below_cells = row_borders(below) if below is not None else None
+    for r, cells in enumerate(rows):
+        row = row_from + r
+        for i, (tc, c, grid_span, sides) in enumerate(cells):
+            tcPr = tc.tcPr
+            if tcPr is None:
+                continue
+
+            if table_borders is not None and len(sides) > 0:
+                for side, (element, border) in sides.items():
+                    if side == 'top':
+                        outer, edge = row == 0, 'insideH'
+                        neighbours, merged = facing_borders(rows[r - 1] if r > 0 else above_cells, c, grid_span, 'bottom')
+                        merged = merged or tc.vMerge is not None
+                    elif side == 'bottom':
+                        outer, edge = row == row_count - 1, 'insideH'
+                        neighbours, merged = facing_borders(rows[r + 1] if r < len(rows) - 1 else below_cells, c, grid_span, 'top')
+                        merged = merged or tc.vMerge is not None
+                    else:
+                        # horizontally merged cells are one tc already, the neighbour is the next (or previous) one
+                        outer, edge = c == 0 if side == 'start' else c + grid_span == cols, 'insideV'
+                        neighbour = (cells[i - 1] if i > 0 else None) if side == 'start' else (cells[i + 1] if i + 1 < len(cells) else None)
+                        neighbour_border = neighbour[3].get(FACING[side]) if neighbour is not None else None
+                        neighbours, merged = [neighbour_border[1] if neighbour_border is not None else None], False
+
+                    if outer:
+                        drop = border == table_borders.get(side)
+                    elif len(neighbours) == 0 or None in neighbours:
+                        # what is across the edge is not known
+                        drop = False
+                    elif border == table_borders.get(edge) and all(neighbour == border for neighbour in neighbours):
+                        drop = True
+                    else:
+                        drop = side in ('top', 'start') and not merged and all(neighbour == border for neighbour in neighbours)
+
+                    if drop:
+                        element.getparent().remove(element)
+
+                tcBorders = tcPr.find(qn('w:tcBorders'))
+                if tcBorders is not None and len(tcBorders) == 0:
+                    tcPr.remove(tcBorders)
+
+            shd = tcPr.find(qn('w:shd'))
+            if table_background is not None and shd is not None and shd.get(qn('w:fill')) == table_background:
+                tcPr.remove(shd)
+
+
+def write_table_part(stream, part_table, part_from, table_rows, table_borders, table_background, above, below):
+    '''
+        hoists the table properties of a part of a streamed table and writes it out, returns its last row as it was before hoisting (what the next part has
+        above it)
+    '''
+    last_tr = deepcopy(part_table._tbl.tr_lst[-1])
+    hoist_table_properties(part_table, table_borders, table_background, part_from, table_rows, above, below)
+    stream.write(part_table)
+    return last_tr
+
+
+def merged_cell_width(row, col, start_row, start_col, merge_index, column_widths):
+    merge_span = merge_index.span(row + start_row, col + start_col)
     cell_width = 0
-    for merge in merges:
-        if merge['startRowIndex'] == (row + start_row) and merge['startColumnIndex'] == (col + start_col):
-            for c in range(col, merge['endColumnIndex'] - start_col):
-                cell_width = cell_width + column_widths[c]
+    if merge_span is not None:
+        for c in range(col, col + merge_span[1]):
+            cell_width = cell_width + column_widths[c]
 
     if cell_width == 0:
         return column_widths[col]
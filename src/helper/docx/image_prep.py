@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+'''
+prepares images for embedding - images larger than their displayed size (at the target dpi) are resampled down, opaque pngs are optionally converted to jpeg
+and metadata is dropped. the work is done in a process pool and the results are cached by source hash + target size so that unchanged images are prepared only once
+'''
+
+import os
+import math
+import hashlib
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from helper.logger import *
+
+def display_size(image, container_width):
+    '''
+        the size (in inches) an image spec {'width', 'height', 'dpi', ...} is rendered at inside a container (cell) of container_width inches
+    '''
+    dpi_x = 150 if image['dpi'][0] == 0 else image['dpi'][0]
+    dpi_y = 150 if image['dpi'][1] == 0 else image['dpi'][1]
+    image_width = image['width'] / dpi_x
+    image_height = image['height'] / dpi_y
+    if image_width > container_width:
+        adjust_ratio = (container_width / image_width)
+        # keep a padding of 0.1 inch
+        image_width = container_width - 0.2
+        image_height = image_height * adjust_ratio
+
+    return image_width, image_height
+
+def is_opaque(im):
+    if im.mode in ('RGB', 'L', 'CMYK'):
+        return True
+
+    if im.mode in ('RGBA', 'LA'):
+        return im.getchannel('A').getextrema()[0] == 255
+
+    return False
+
+def prepare_image(source_path, target_path, width_px, height_px, jpeg_quality):
+    '''
+        runs in a worker process, writes the prepared image to target_path
+    '''
+    im = Image.open(source_path)
+    if im.mode == 'P':
+        im = im.convert('RGBA')
+
+    if im.width > width_px or im.height > height_px:
+        im = im.resize((width_px, height_px), Image.LANCZOS)
+
+    # metadata (exif, icc, text chunks) is not carried over as we do not pass it to save
+    # the file is written under a temporary name first, renderers in other processes may be looking for the same target
+    temp_path = '{0}.{1}.part'.format(target_path, os.getpid())
+    if target_path.endswith('.jpg'):
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        im.save(temp_path, 'JPEG', quality=jpeg_quality, optimize=True)
+    else:
+        im.save(temp_path, 'PNG', optimize=True)
+
+    os.replace(temp_path, target_path)
+    return target_path
+
+class ImagePreparer(object):
+
+    def __init__(self, cache_dir, dpi=150, jpeg_quality=85, png_to_jpeg=False, workers=None):
+        self._cache_dir = cache_dir
+        self._dpi = dpi
+        self._jpeg_quality = jpeg_quality
+        self._png_to_jpeg = png_to_jpeg
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._source_hashes = {}
+        self._prepared = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_hash(self, source_path):
+        if source_path not in self._source_hashes:
+            with open(source_path, 'rb') as f:
+                self._source_hashes[source_path] = hashlib.sha1(f.read()).hexdigest()
+
+        return self._source_hashes[source_path]
+
+    def job(self, source_path, width, height):
+        '''
+            (target_path, width_px, height_px) for the image displayed at width x height inches, target_path is None if the image can be used as it is
+        '''
+        width_px = max(1, int(math.ceil(width * self._dpi)))
+        height_px = max(1, int(math.ceil(height * self._dpi)))
+
+        im = Image.open(source_path)
+        oversized = im.width > width_px or im.height > height_px
+        to_jpeg = self._png_to_jpeg and im.format == 'PNG' and is_opaque(im)
+        if not oversized and not to_jpeg:
+            return None, width_px, height_px
+
+        if to_jpeg or im.format == 'JPEG':
+            suffix = '.jpg'
+        else:
+            suffix = '.png'
+
+        key = '{0}-{1}x{2}-q{3}'.format(self.source_hash(source_path), width_px, height_px, self._jpeg_quality if suffix == '.jpg' else 0)
+        return os.path.join(self._cache_dir, '{0}{1}'.format(key, suffix)), width_px, height_px
+
+    def prepare(self, images):
+        '''
+            images is a list of (source_path, width_inches, height_inches), everything not already prepared is prepared in the process pool
+        '''
+        pending = {}
+        for source_path, width, height in images:
+            if (source_path, width, height) in self._prepared:
+                continue
+
+            try:
+                target_path, width_px, height_px = self.job(source_path, width, height)
+            except:
+                warn('.... could not open image {0} for preparation, it will be embedded as it is'.format(source_path))
+                target_path = None
+
+            if target_path is None or os.path.exists(target_path):
+                self._prepared[(source_path, width, height)] = target_path or source_path
+            else:
+                pending[(source_path, width, height)] = (source_path, target_path, width_px, height_px, self._jpeg_quality)
+
+        if len(pending) == 0:
+            return
+
+        # no pool with workers=0, the images are prepared right here (we may be in a worker process already)
+        if self._workers == 0:
+            for key, args in pending.items():
+                try:
+                    self._prepared[key] = prepare_image(*args)
+                except:
+                    warn('.... could not prepare image {0}, it will be embedded as it is'.format(key[0]))
+                    self._prepared[key] = key[0]
+
+            return
+
+        # docx files of a batch build are rendered on several threads, they share the pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+
+        info('.... preparing {0} image(s)'.format(len(pending)))
+        futures = {key: self._executor.submit(prepare_image, *args) for key, args in pending.items()}
+        for key, future in futures.items():
+            try:
+                self._prepared[key] = future.result()
+            except:
+                warn('.... could not prepare image {0}, it will be embedded as it is'.format(key[0]))
+                self._prepared[key] = key[0]
+
+    def path_for(self, source_path, width, height):
+        # the path to embed for the image displayed at width x height inches
+        if (source_path, width, height) not in self._prepared:
+            self.prepare([(source_path, width, height)])
+
+        return self._prepared[(source_path, width, height)]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+def image_preparer(temp_dir, docx_related, workers=None):
+    # the ImagePreparer configured by docx-related, None if images are embedded as they are
+    if not docx_related.get('prepare-images', True):
+        return None
+
+    return ImagePreparer(os.path.abspath('{0}/images'.format(temp_dir)), dpi=docx_related.get('image-dpi', 150), jpeg_quality=docx_related.get('image-jpeg-quality', 85), png_to_jpeg=docx_related.get('image-png-to-jpeg', False), workers=workers)
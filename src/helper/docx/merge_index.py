@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+'''
+the merges of a worksheet indexed once for a table - an anchor map (worksheet cell a merge starts at -> its span) for merged widths and an occupancy grid
+(which merge covers a table cell) for where a merge continues, so that neither rendering nor merging goes through the whole merge list per cell
+'''
+
+import numpy
+
+class MergeIndex(object):
+
+    def __init__(self, merge_data, start_row, start_col, row_from, row_to, cols):
+        # (row, column) of the worksheet a merge starts at -> (rows, columns) it spans
+        self._spans = {}
+        for m in merge_data:
+            self._spans.setdefault((m['startRowIndex'], m['startColumnIndex']), (m['endRowIndex'] - m['startRowIndex'], m['endColumnIndex'] - m['startColumnIndex']))
+
+        # merges within worksheet rows row_from..row_to as (first row, first column, last row, last column) of the table, in worksheet order
+        self._merges = []
+        self._grid = numpy.full((row_to - row_from + 1, cols), -1, dtype=numpy.int32)
+        for m in merge_data:
+            if m['startRowIndex'] < (row_from - 1) or m['endRowIndex'] > (row_to):
+                continue
+
+            first_row = m['startRowIndex'] - (row_from - start_row) - 1
+            last_row = m['endRowIndex'] - (row_from - start_row) - 2
+            first_col = m['startColumnIndex'] - start_col
+            last_col = m['endColumnIndex'] - start_col - 1
+            self._grid[first_row:last_row + 1, first_col:last_col + 1] = len(self._merges)
+            self._merges.append((first_row, first_col, last_row, last_col))
+
+        # table rows a merge continues below
+        self._continued = ((self._grid[:-1] >= 0) & (self._grid[:-1] == self._grid[1:])).any(axis=1)
+
+    def __len__(self):
+        return len(self._merges)
+
+    def span(self, row, col):
+        # (rows, columns) of the merge starting at worksheet cell (row, col), None if no merge starts there
+        return self._spans.get((row, col))
+
+    def continued(self, r):
+        # whether a merge covers table row r and the row below it
+        return r < len(self._continued) and bool(self._continued[r])
+
+    def merges(self, row_from=0, row_to=None):
+        '''
+            the merges within table rows row_from..row_to (all of them by default) with rows counted from row_from
+        '''
+        if row_to is None:
+            row_to = self._grid.shape[0] - 1
+
+        return [(first_row - row_from, first_col, last_row - row_from, last_col) for first_row, first_col, last_row, last_col in self._merges if first_row >= row_from and last_row <= row_to]
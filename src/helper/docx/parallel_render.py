@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+'''
+renders section bodies in a process pool - every worker prepares the template (with our styles) once, renders the body of a section into a fresh copy of it
+and keeps the result in the fragment cache (see docx_fragment.py). the sections are then generated in order as usual: section breaks and headers/footers
+are added by the parent and the rendered bodies are spliced in with their images and drawing ids remapped, so the docx is the same as a serial build
+
+only table and pdf sections are rendered in workers, they are what takes time. sections embedding a gsheet are walked into, their own sections are
+rendered in workers like any other
+'''
+
+import io
+import importlib
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from docx import Document
+from docx.shared import Inches
+
+from helper.logger import *
+from helper.tracer import span
+from helper.docx.docx_helper import DocxHelper
+from helper.docx.docx_writer import set_render_options, RENDER_OPTIONS
+from helper.docx.docx_fragment import FragmentCache
+from helper.docx.image_prep import image_preparer
+from helper.gsheet.worksheet_ir import Worksheet
+
+PARALLEL_CONTENT_TYPES = ['table', 'pdf']
+
+# state of a worker process, set up once by init_worker
+WORKER = {}
+
+def init_worker(context, fragment_root, render_options):
+    docxhelper = DocxHelper(context['files']['docx-template'], context['files']['docx-styles'], None)
+    stream = io.BytesIO()
+    docxhelper.init().save(stream)
+
+    WORKER['template'] = stream.getvalue()
+    WORKER['section-specs'] = docxhelper._sections
+    WORKER['context'] = context
+    WORKER['fragments'] = FragmentCache(fragment_root, context)
+
+    # the worker is one of many processes already, images are prepared in it rather than in yet another pool
+    set_render_options({**render_options, 'image-preparer': image_preparer(context['dirs']['temp-dir'], context['docx-related'], workers=0)})
+
+def section_width(doc, section_spec):
+    # the width add_section gives the parent for the same spec, going through the same (twips) rounding
+    section = doc.sections[-1]
+    section.page_width = Inches(section_spec['page_width'])
+    section.left_margin = Inches(section_spec['left_margin'])
+    section.right_margin = Inches(section_spec['right_margin'])
+    section.gutter = Inches(section_spec['gutter'])
+    return section.page_width.inches - section.left_margin.inches - section.right_margin.inches - section.gutter.inches
+
+def render_section(content_type, data, section_spec, fingerprint):
+    # runs in a worker process
+    doc = Document(io.BytesIO(WORKER['template']))
+    page_width = section_width(doc, section_spec)
+
+    fragments = WORKER['fragments']
+    mark = fragments.mark(doc)
+    module = importlib.import_module('formatter.{0}_formatter'.format(content_type))
+    module.render_body(data, doc, page_width, WORKER['section-specs'], WORKER['context'])
+    fragments.store(fingerprint, doc, mark)
+    return fingerprint
+
+def streamed(section):
+    # sections with tables long enough to be streamed are rendered in order, a streamed table cannot be carried over as a fragment
+    contents = section.get('contents')
+    if not isinstance(contents, Worksheet) or RENDER_OPTIONS['stream-table-rows'] == 0:
+        return False
+
+    return contents.row_count >= RENDER_OPTIONS['stream-table-rows']
+
+def renderable_sections(sections):
+    # (content type, section) of every section a worker can render, in document order
+    for section in sections:
+        content_type = section['content-type']
+        if content_type == 'gsheet': content_type = 'table'
+
+        contents = section.get('contents')
+        if content_type == 'table' and isinstance(contents, dict) and 'sections' in contents:
+            yield from renderable_sections(contents['sections'])
+
+        elif content_type in PARALLEL_CONTENT_TYPES and not streamed(section):
+            yield content_type, section
+
+def render_sections(sections, section_specs, context, workers):
+    '''
+        renders the bodies of sections not in the fragment cache yet in a pool of workers processes, generate_docx splices them in afterwards
+    '''
+    fragments = context['fragment-cache']
+    jobs = {}
+    for content_type, data in renderable_sections(sections):
+        section_spec = section_specs['continuous_portrait' if data['section-break'] == '-' else data['section-break']]
+        fingerprint = fragments.fingerprint(data, section_spec)
+        if fingerprint not in jobs and not fragments.cached(fingerprint):
+            jobs[fingerprint] = (content_type, data, section_spec)
+
+    if len(jobs) == 0:
+        return
+
+    # workers get only what rendering needs, the rest of the context (clients, pools) would not pickle
+    worker_context = {'files': context['files'], 'dirs': context['dirs'], 'docx-related': context['docx-related']}
+
+    info('.. rendering {0} section(s) in {1} worker processes'.format(len(jobs), workers))
+    with span('parallel-render', sections=len(jobs), workers=workers):
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_context, fragments.root, {k: v for k, v in RENDER_OPTIONS.items() if k != 'image-preparer'})) as executor:
+            futures = {executor.submit(render_section, content_type, data, section_spec, fingerprint): data for fingerprint, (content_type, data, section_spec) in jobs.items()}
+            for future in as_completed(futures):
+                try:
+                    fragments.prerendered(future.result())
+                except Exception as e:
+                    # nothing is lost, a section without a fragment is rendered in order by its formatter
+                    data = futures[future]
+                    warn('.. section {0} {1} could not be rendered in a worker ({2}), it will be rendered in order'.format(data['section'], data['heading'], e))
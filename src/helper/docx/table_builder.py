@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+'''
+the lxml table engine (docx-related.table-engine: lxml) - cells are built from prepared w:tc and w:r elements instead of being formatted one property at a
+time through python-docx proxies. the properties of a cell (tcPr and the pPr of its paragraph) are set once per distinct format, by the very code the
+python-docx engine runs (docx_writer.format_cell), and cloned for every cell having that format - runs are cloned the same way per character style
+
+rows are not looked up through the table (row_cells rebuilds the whole cell grid every time), the tc elements of a row are read once and replaced in
+place. merges are applied the same way for both engines (see docx_writer.merge_table_cells)
+
+cells with images, embedded worksheets or notes asking for a paragraph style or page numbers are rare, they are rendered by the python-docx engine in place.
+the docx is the same whichever engine renders it
+'''
+
+import time
+import weakref
+import threading
+
+from copy import deepcopy
+
+from docx.shared import Inches
+from docx.oxml import OxmlElement
+from docx.table import _Cell
+from docx.text.run import Run
+
+from helper.logger import *
+from helper.docx import docx_writer
+from helper.docx.docx_util import set_run_character_style, docx_format
+from helper.docx.docx_helper import character_style
+
+# the prepared elements of every document (by its part), they go with the document
+TEMPLATES = weakref.WeakKeyDictionary()
+_templates_lock = threading.Lock()
+
+class Templates(object):
+    '''
+        prepared elements of a document, they are only ever cloned - cells by (width in twips, table spacing, new-page, keep-with-next, format) and runs
+        by (character style, format)
+    '''
+    def __init__(self):
+        self.tcs = {}
+        self.runs = {}
+
+def document_templates(doc):
+    with _templates_lock:
+        if doc.part not in TEMPLATES:
+            TEMPLATES[doc.part] = Templates()
+
+        return TEMPLATES[doc.part]
+
+class TableBuilder(object):
+
+    def __init__(self, doc, table):
+        self._doc = doc
+        self._table = table
+        self._trs = table._tbl.tr_lst
+        self._templates = document_templates(doc)
+
+    def cell_template(self, tc, cell_data, width, table_spacing):
+        # a tc having the properties of the cell and an empty paragraph, tc is an unformatted cell of the table to prepare it from
+        directives = cell_data.directives
+        # the width as the tcW it is written to, widths that differ by less than a twip give the same cell
+        key = (Inches(width).twips, table_spacing, directives.new_page, directives.keep_with_next, cell_data.format)
+
+        template = self._templates.tcs.get(key)
+        if template is None:
+            template = deepcopy(tc)
+            cell = _Cell(template, self._table)
+            docx_writer.format_cell(cell, cell.paragraphs[0], cell_data, width, table_spacing)
+            self._templates.tcs[key] = template
+
+        return template
+
+    def add_run(self, p, text, style_id, format, base_format):
+        key = (style_id, format)
+        template = self._templates.runs.get(key)
+        if template is None:
+            template = OxmlElement('w:r')
+            set_run_character_style(Run(template, None), style_id, format, base_format)
+            self._templates.runs[key] = template
+
+        r = deepcopy(template)
+        if text:
+            r.text = text
+
+        p.append(r)
+
+    def render_cell(self, tc, cell_data, width, r, c, start_row, start_col, merge_index, column_widths, table_spacing):
+        '''
+            renders cell_data in place of tc
+        '''
+        directives = cell_data.directives
+        if cell_data.image is not None or cell_data.contents is not None or directives.style is not None or directives.page_number is not None:
+            docx_writer.render_content_in_cell(self._doc, _Cell(tc, self._table), cell_data, width, r, c, start_row, start_col, merge_index, column_widths, table_spacing)
+            return
+
+        new_tc = deepcopy(self.cell_template(tc, cell_data, width, table_spacing))
+        tc.getparent().replace(tc, new_tc)
+
+        if cell_data.format is not None and cell_data.text is not None:
+            p = new_tc.p_lst[0]
+            base_format = docx_format(cell_data.format).text
+            style_id = character_style(self._doc, base_format)
+            for text, format in docx_writer.text_runs(cell_data):
+                self.add_run(p, text, style_id, format, base_format)
+
+    def render_rows(self, row_data, data_row_from, table_row_from, row_count, start_row, start_col, merge_index, column_widths, table_spacing, log=True):
+        '''
+            renders row_count data rows (from data_row_from) into the rows of the table (from table_row_from)
+        '''
+        last_time = int(round(time.time() * 1000))
+        table_row_index = table_row_from
+        for data_row_index in range(data_row_from, data_row_from + row_count):
+            row_values = row_data[data_row_index]
+            if row_values is not None:
+                tcs = self._trs[table_row_index].tc_lst
+
+                for c in range(0, len(row_values)):
+                    self.render_cell(tcs[c], row_values[c], column_widths[c], data_row_index, c, start_row, start_col, merge_index, column_widths, table_spacing)
+
+                if table_row_index % 100 == 0:
+                    current_time = int(round(time.time() * 1000))
+                    if log: info('  .... cell rendered for {0}/{1} rows : {2} ms'.format(table_row_index, table_row_from + row_count, current_time - last_time))
+                    last_time = current_time
+
+            table_row_index = table_row_index + 1
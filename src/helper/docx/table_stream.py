@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+'''
+streamed tables - a very large table is rendered in parts, the rows of every part are serialized to a file as soon as the part is done and the part is
+dropped from the document, so memory does not grow with the number of rows. the document keeps a placeholder paragraph where the table goes and
+finish_table_streams puts the table in its place (streaming it from the file) once the docx is saved
+
+the placeholder carries the largest drawing id of the streamed rows as an id attribute, python-docx numbers new drawings after the largest id it finds
+in the document so that images after (and in later parts of) the table are numbered as if the table was there
+'''
+
+import os
+import re
+import uuid
+import shutil
+import zipfile
+
+from lxml import etree
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from helper.logger import *
+
+PLACEHOLDER = re.compile(rb'<w:p id="\d+" stream="([0-9a-f]+)"/>')
+NAMESPACE_DECLARATION = re.compile(rb' xmlns:([A-Za-z0-9]+)="([^"]*)"')
+
+class TableStream(object):
+
+    def __init__(self, doc, stream_dir):
+        os.makedirs(stream_dir, exist_ok=True)
+        self._key = uuid.uuid4().hex
+        self._file = open(stream_path(stream_dir, self._key), 'wb')
+        self._started = False
+        self.size = 0
+
+        # namespaces the document root declares, serialized rows would declare them again
+        self._declared = {prefix.encode('utf-8'): uri.encode('utf-8') for prefix, uri in doc.element.nsmap.items() if prefix is not None}
+
+        # the table goes where the placeholder is
+        self._placeholder = OxmlElement('w:p')
+        self._placeholder.set('id', '0')
+        self._placeholder.set('stream', self._key)
+        doc.element.body.sectPr.addprevious(self._placeholder)
+
+    def serialize(self, element):
+        # the element as it would be serialized in place, without the namespace declarations it inherits from the document root
+        xml = etree.tostring(element)
+        end = xml.index(b'>')
+        head = NAMESPACE_DECLARATION.sub(lambda m: b'' if self._declared.get(m.group(1)) == m.group(2) else m.group(0), xml[:end])
+        return head + xml[end:]
+
+    def emit(self, xml):
+        self._file.write(xml)
+        self.size = self.size + len(xml)
+
+    def write(self, table):
+        '''
+            writes the rows of table (a part of the streamed table, rendered in the doc) out and removes it from the doc
+        '''
+        tbl = table._tbl
+        if not self._started:
+            # the parts are created alike, table properties and grid come from the first one
+            self.emit(b'<w:tbl>')
+            self.emit(self.serialize(tbl.tblPr))
+            self.emit(self.serialize(tbl.tblGrid))
+            self._started = True
+
+        for tr in tbl.tr_lst:
+            self.emit(self.serialize(tr))
+
+        doc_pr_ids = [int(doc_pr.get('id')) for doc_pr in tbl.iter(qn('wp:docPr'))]
+        if len(doc_pr_ids) > 0:
+            self._placeholder.set('id', str(max(doc_pr_ids + [int(self._placeholder.get('id'))])))
+
+        tbl.getparent().remove(tbl)
+
+    def close(self):
+        self.emit(b'</w:tbl>')
+        self._file.close()
+
+    def discard(self):
+        # the table could not be rendered, its file goes
+        self._file.close()
+        os.remove(self._file.name)
+
+def stream_path(stream_dir, key):
+    return os.path.join(stream_dir, '{0}.xml'.format(key))
+
+def has_table_streams(element):
+    return any(p.get('stream') is not None for p in element.iter(qn('w:p')))
+
+def discard_table_streams(doc, stream_dir):
+    '''
+        removes the stream files of the tables streamed for doc, for a build that fails before finish_table_streams has put them in the docx
+    '''
+    for p in doc.element.body.iter(qn('w:p')):
+        key = p.get('stream')
+        if key is not None and os.path.exists(stream_path(stream_dir, key)):
+            os.remove(stream_path(stream_dir, key))
+
+def clear_table_streams(stream_dir):
+    # stream files left over by builds that did not get to finish (killed runs), no build is running when this is called
+    if os.path.isdir(stream_dir):
+        for name in os.listdir(stream_dir):
+            os.remove(os.path.join(stream_dir, name))
+
+def finish_table_streams(docx_path, stream_dir):
+    '''
+        replaces the placeholders in the saved docx with their tables, the document part is written out piece by piece and the stream files are removed
+    '''
+    with zipfile.ZipFile(docx_path, 'r') as source:
+        document_xml = source.read('word/document.xml')
+        keys = [key.decode('utf-8') for key in PLACEHOLDER.findall(document_xml)]
+        if len(keys) == 0:
+            return
+
+        temp_path = '{0}.part'.format(docx_path)
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                if item.filename != 'word/document.xml':
+                    with source.open(item) as f_in, target.open(item, 'w') as f_out:
+                        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                    continue
+
+                with target.open(item, 'w', force_zip64=True) as f_out:
+                    position = 0
+                    for m in PLACEHOLDER.finditer(document_xml):
+                        f_out.write(document_xml[position:m.start()])
+                        with open(stream_path(stream_dir, m.group(1).decode('utf-8')), 'rb') as f_in:
+                            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                        position = m.end()
+
+                    f_out.write(document_xml[position:])
+
+    os.replace(temp_path, docx_path)
+    for key in keys:
+        os.remove(stream_path(stream_dir, key))
+
+    debug('.. {0} streamed table(s) written into {1}'.format(len(keys), docx_path))
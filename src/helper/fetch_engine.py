@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''
+bounded thread-pool for google api (and other network) calls, throttled by a token-bucket so that we stay within the sheets read quota
+'''
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from helper.logger import *
+
+class TokenBucket(object):
+    '''
+        a token is added every 60/requests_per_minute seconds up to capacity, every request takes one token and waits if there is none
+    '''
+    def __init__(self, requests_per_minute, capacity=1):
+        self._rate = requests_per_minute / 60.0
+        self._capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens = self._tokens - 1
+                    return
+
+                wait_for = (1 - self._tokens) / self._rate
+
+            time.sleep(wait_for)
+
+class FetchEngine(object):
+
+    def __init__(self, concurrency, requests_per_minute=None, name='fetch'):
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+
+        # no requests_per_minute means the engine is not quota bound (e.g. plain web downloads)
+        self._bucket = None
+        if requests_per_minute is not None:
+            self._bucket = TokenBucket(requests_per_minute, capacity=concurrency)
+
+    def throttle(self):
+        # every quota bound api request must call this just before it is executed
+        if self._bucket is not None:
+            self._bucket.acquire()
+
+    def submit(self, fn, *args):
+        return self._executor.submit(fn, *args)
+
+    def map(self, fn, items):
+        # runs fn on all items concurrently and returns the results in the order of items, the first exception is raised
+        futures = [self._executor.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
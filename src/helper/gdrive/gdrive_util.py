@@ -1,8 +1,26 @@
 #!/usr/bin/env python3
 
+import os
+
 from helper.logger import *
+from helper.tracer import span
+from helper.retry_policy import classify
+from helper.gsheet.gsheet_util import thread_http
 
 from googleapiclient import errors
+from pydrive.files import GoogleDriveFile
+
+# drive (v2, as pydrive uses) metadata we need for any referenced file, downloadUrl lets pydrive download without asking for metadata again
+DRIVE_FILE_FIELDS = 'id,mimeType,title,md5Checksum,modifiedDate,downloadUrl'
+
+# drive batch requests take at most 100 requests
+DRIVE_BATCH_SIZE = 100
+
+MIME_SUFFIXES = {
+    'application/pdf': '.pdf',
+    'text/plain': '.txt',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx'
+}
 
 def copy_drive_file(service, origin_file_id, copy_title):
     """
@@ -27,15 +45,136 @@ def download_drive_file(param, destination, context):
     f = context['drive'].CreateFile(param)
     f.GetContentFile(destination)
 
+def drive_file_id(link):
+    # drive links look like https://drive.google.com/file/d/<id>/view?..., anything else is taken as the id itself
+    link = link.strip()
+    if link.startswith('https://drive.google.com/file/d/'):
+        return link.replace('https://drive.google.com/file/d/', '').split('/')[0]
+
+    return link
+
+def resolve_drive_files(ids, context):
+    '''
+        metadata of all the drive files in ids with one batch request (per DRIVE_BATCH_SIZE ids), kept in context['drive-files'] by id
+        files we could not get metadata for are left out and are asked for one by one when they are needed
+    '''
+    pending = [id for id in dict.fromkeys(ids) if id not in context['drive-files']]
+    for i in range(0, len(pending), DRIVE_BATCH_SIZE):
+        chunk = pending[i:i + DRIVE_BATCH_SIZE]
+        results = {}
+        failures = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+                failures.pop(request_id, None)
+            else:
+                failures[request_id] = exception
+
+        def execute():
+            # a retry only asks again for what did not succeed
+            service = context['drive-service']
+            batch = service.new_batch_http_request(callback=callback)
+            for id in chunk:
+                if id not in results:
+                    batch.add(service.files().get(fileId=id, fields=DRIVE_FILE_FIELDS), request_id=id)
+
+            context['fetch-engine'].throttle()
+            batch.execute(http=thread_http(context))
+
+            # parts that failed with a retryable error (429, 5xx) make the whole batch go through the retry-policy again
+            retryable = [e for e in failures.values() if classify(e)[0]]
+            if len(retryable) > 0:
+                raise retryable[0]
+
+        info('resolving ... {0} drive file(s) in one request'.format(len(chunk)))
+        try:
+            with span('drive-metadata', files=len(chunk)):
+                context['retry-policy'].call(execute, 'drive metadata batch request')
+        except:
+            warn('drive metadata batch request failed, the files will be resolved one by one')
+
+        for id, exception in failures.items():
+            warn('could not resolve drive file {0}: {1}'.format(id, exception))
+
+        context['drive-files'].update(results)
+
+def drive_file(id, context):
+    # a pydrive file with the metadata resolved in bulk if we have it, so that nothing more is asked for before the download
+    if id not in context['drive-files']:
+        resolve_drive_files([id], context)
+
+    metadata = context['drive-files'].get(id)
+    if metadata is None:
+        return None
+
+    return GoogleDriveFile(context['drive'].auth, metadata, uploaded=True)
+
+def drive_file_path(id, context):
+    '''
+        local path of drive file id in the media-cache, downloaded only if its md5 has changed since we last had it, once for the whole run
+    '''
+    if id not in context['drive-downloads']:
+        local_path = None
+        f = drive_file(id, context)
+        if f is not None:
+            suffix = MIME_SUFFIXES.get(f['mimeType'], os.path.splitext(f['title'])[1])
+            try:
+                local_path = context['media-cache'].fetch_drive_file(f, suffix)
+            except:
+                warn('.... could not download drive file {0}'.format(id))
+
+        context['drive-downloads'][id] = local_path
+
+    return context['drive-downloads'][id]
+
+def download_drive_files(ids, context):
+    '''
+        resolves the metadata of all ids in bulk and then downloads the files concurrently, returns {id: local path or None}
+    '''
+    ids = list(dict.fromkeys(ids))
+    resolve_drive_files(ids, context)
+    with span('drive-downloads', files=len(ids)):
+        paths = context['download-engine'].map(lambda id: drive_file_path(id, context), ids)
+
+    return dict(zip(ids, paths))
+
+def download_pdf_from_drive(url, context):
+    pdf_url = url.strip()
+
+    id = drive_file_id(pdf_url)
+    info('drive file id to be downloaded is {0}'.format(id))
+    f = drive_file(id, context)
+    if f is None or f['mimeType'] != 'application/pdf':
+        warn('drive url {0} is not a pdf'.format(url))
+        return None
+
+    pdf_name = f['title']
+    if not pdf_name.endswith('.pdf'):
+        pdf_name = pdf_name + '.pdf'
+
+    local_path = drive_file_path(id, context)
+    if local_path is None:
+        error('.... could not download pdf: {0}'.format(pdf_url))
+        return None
+
+    return {'pdf_name': pdf_name, 'pdf_path': local_path}
+
 def read_drive_file(drive_url, context):
     url = drive_url.strip()
 
-    id = url.replace('https://drive.google.com/file/d/', '')
-    id = id.split('/')[0]
+    id = drive_file_id(url)
     # debug('drive file id to be read from is {0}'.format(id))
-    f = context['drive'].CreateFile({'id': id})
+    f = drive_file(id, context)
+    if f is None:
+        return None
+
     if f['mimeType'] != 'text/plain':
         warn('drive url {0} mime-type is {1} which may not be readable as text'.format(url, f['mimeType']))
 
-    text = f.GetContentString()
-    return text
+    local_path = drive_file_path(id, context)
+    if local_path is None:
+        return None
+
+    with open(local_path, 'r', encoding='utf-8') as text_file:
+        return text_file.read()
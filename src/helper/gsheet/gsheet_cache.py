@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+'''
+on-disk cache of worksheet grid data (spreadsheets.get responses) that survives across runs
+the cache is keyed by spreadsheet id + worksheet id and is valid as long as the spreadsheet's drive version does not change
+'''
+import os
+import json
+import shutil
+
+from helper.logger import *
+from helper.gsheet.gsheet_util import throttled_call
+
+def cache_dir(sheet, context):
+    return os.path.join(context['tmp-dir'], 'gsheet-cache', sheet.id)
+
+def validate_cache(sheet, context):
+    '''
+        one drive metadata call per spreadsheet, if the spreadsheet has been modified since the cache was written, the cache is discarded
+    '''
+    if not context['gsheet-disk-cache'] or sheet.id in context['gsheet-cache-valid']:
+        return
+
+    try:
+        f = context['drive'].CreateFile({'id': sheet.id})
+        throttled_call(lambda: f.FetchMetadata(fields='version,modifiedDate'), context, 'drive metadata request for {0}'.format(sheet.title))
+        # the field mask is part of the revision, responses fetched with a different mask are not reused
+        revision = {'version': f['version'], 'modifiedDate': f['modifiedDate'], 'fields': context['gsheet-grid-fields']}
+    except:
+        warn('could not read drive metadata for {0}, worksheet cache is not used'.format(sheet.title))
+        context['gsheet-cache-valid'][sheet.id] = False
+        return
+
+    path = cache_dir(sheet, context)
+    revision_path = os.path.join(path, 'revision.json')
+    if os.path.exists(revision_path):
+        with open(revision_path, 'r', encoding='utf-8') as f:
+            cached_revision = json.load(f)
+
+        if cached_revision == revision:
+            info('worksheet cache for {0} is up-to-date at version {1}'.format(sheet.title, revision['version']))
+            context['gsheet-cache-valid'][sheet.id] = True
+            return
+
+        info('{0} has changed since version {1}, discarding worksheet cache'.format(sheet.title, cached_revision.get('version')))
+        shutil.rmtree(path, ignore_errors=True)
+
+    os.makedirs(path, exist_ok=True)
+    write_json(revision_path, revision)
+    context['gsheet-cache-valid'][sheet.id] = True
+
+def load_response(sheet, ws, context):
+    if not context.get('gsheet-cache-valid', {}).get(sheet.id, False):
+        return None
+
+    response_path = os.path.join(cache_dir(sheet, context), '{0}.json'.format(ws.id))
+    if not os.path.exists(response_path):
+        return None
+
+    try:
+        with open(response_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except:
+        warn('cached worksheet {0} : {1} is not readable, it will be fetched again'.format(sheet.title, ws.title))
+        return None
+
+def save_response(sheet, ws, response, context):
+    if not context.get('gsheet-cache-valid', {}).get(sheet.id, False):
+        return
+
+    write_json(os.path.join(cache_dir(sheet, context), '{0}.json'.format(ws.id)), response)
+
+def write_json(path, data):
+    # write into a temporary file and move it in place so that an interrupted run never leaves a half-written cache entry
+    temp_path = '{0}.part'.format(path)
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+    os.replace(temp_path, path)
@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import threading
 import pygsheets
 
 import httplib2
 
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient import discovery
+from googleapiclient.http import build_http, DEFAULT_HTTP_TIMEOUT_SEC
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 
 from helper.logger import *
+from helper.tracer import span
+from helper.fetch_engine import FetchEngine
+from helper.retry_policy import RetryPolicy
+from helper.media_cache import MediaCache
+from helper.http_client import HttpClient
+from helper.standin.standin_http import StandinHttp, HttpFactoryAuth
 from helper.gsheet.gsheet_util import *
 from helper.gsheet.gsheet_reader import *
 from helper.gsheet.gsheet_writer import *
+from processor.table_processor import GRID_FIELDS, CELL_FIELDS
 
 class GsheetHelper(object):
 
@@ -30,40 +40,105 @@ class GsheetHelper(object):
         # as we go further we put everything inside a single dict _context
         self._context = {}
 
-        _G = pygsheets.authorize(service_account_file=config['files']['google-cred'])
-        self._context['_G'] = _G
+        # every google api client gets its http from new-http, google-endpoint sends them all to a local stand-in (see google-standin.py) instead of google
+        endpoint = config.get('google-endpoint')
+        if endpoint:
+            warn('google api requests go to the stand-in at {0}'.format(endpoint))
+            self._context['new-http'] = lambda: StandinHttp(endpoint, timeout=DEFAULT_HTTP_TIMEOUT_SEC)
+        else:
+            self._context['new-http'] = build_http
 
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(config['files']['google-cred'], scopes=['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets'])
-        credentials.authorize(httplib2.Http())
+        with span('auth'):
+            _G = pygsheets.authorize(service_account_file=config['files']['google-cred'], http=self._context['new-http']())
+            self._context['_G'] = _G
+            self._context['google-cred'] = config['files']['google-cred']
 
-        self._context['service'] = discovery.build('sheets', 'v4', credentials=credentials)
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(config['files']['google-cred'], scopes=['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets'])
+            self._context['credentials'] = credentials
+            if endpoint:
+                # googleapiclient batches refresh tokens with an http of their own which would go to google, so we have the token before the first batch
+                credentials.get_access_token(self._context['new-http']())
 
-        gauth = GoogleAuth()
-        gauth.credentials = credentials
+            self._context['service'] = discovery.build('sheets', 'v4', http=credentials.authorize(self._context['new-http']()))
+            self._context['drive-service'] = discovery.build('drive', 'v2', http=credentials.authorize(self._context['new-http']()))
+
+            gauth = GoogleAuth() if not endpoint else HttpFactoryAuth(self._context['new-http'])
+            gauth.credentials = credentials
+
+            self._context['drive'] = GoogleDrive(gauth)
 
-        self._context['drive'] = GoogleDrive(gauth)
         self._context['tmp-dir'] = config['dirs']['temp-dir']
         self._context['index-worksheet'] = config['index-worksheet']
         self._context['gsheet-read-wait-seconds'] = config['gsheet-read-wait-seconds']
         self._context['gsheet-read-try-count'] = config['gsheet-read-try-count']
 
+        # every google api call is retried through the same policy
+        self._context['retry-policy'] = RetryPolicy(config['gsheet-read-try-count'], config.get('gsheet-retry-base-seconds', 1), config['gsheet-read-wait-seconds'], config.get('gsheet-retry-deadline-seconds', 300))
+        self._context['gsheet-batch-size'] = config.get('gsheet-batch-size', 20)
+        self._context['gsheet-disk-cache'] = config.get('gsheet-disk-cache', True)
+        self._context['gsheet-grid-fields'] = GRID_FIELDS.format(','.join(config.get('gsheet-cell-fields', CELL_FIELDS)))
+
+        # all concurrent google api calls go through the fetch-engine which keeps us within the read quota
+        self._context['fetch-engine'] = FetchEngine(config.get('gsheet-read-concurrency', 4), config.get('gsheet-read-requests-per-minute', 60))
+
+        # web downloads (images etc.) are not quota bound, they have their own pool and a per-host connection limit
+        self._context['download-engine'] = FetchEngine(config.get('download-concurrency', 16), name='download')
+
+        # every web request goes through one pooled http client with timeouts, text includes are cached for a short while
+        self._context['http-client'] = HttpClient(config.get('download-per-host', 4), config.get('download-connect-timeout-seconds', 10), config.get('download-read-timeout-seconds', 60), config.get('web-content-ttl-seconds', 300))
+
+        # gsheets (child gsheets embedded in other gsheets) are loaded concurrently on their own pool, their api calls still go through the fetch-engine
+        self._context['gsheet-engine'] = FetchEngine(config.get('gsheet-open-concurrency', 4), name='gsheet')
+
+        # worksheet-cache is nested dictionary of sheet->worksheet as two different sheets may have worksheets of same name, so keying by only worksheet name is not feasible
+        # worksheet-prefetch holds worksheets fetched in batches but not yet processed, keyed the same way as worksheet-cache
+        self._context['worksheet-cache'] = {}
+        self._context['worksheet-prefetch'] = {}
+        self._context['gsheet-cache-valid'] = {}
+
+        # worksheet titles, gids and sizes of every spreadsheet we have opened, keyed by spreadsheet id
+        self._context['sheet-index'] = {}
+
+        # every gsheet is loaded once for the whole run - gsheet-memo is keyed by spreadsheet id, gsheet-ids maps gsheet names to ids
+        self._context['gsheet-memo'] = {}
+        self._context['gsheet-ids'] = {}
+
+        # gsheets being loaded (a future per gsheet name), so that a gsheet wanted by several builds at the same time is loaded once
+        self._context['gsheet-loading'] = {}
+        self._context['gsheet-lock'] = threading.Lock()
+
+        # batch builds want a failed gsheet to fail only its own build, not the whole run
+        self._context['exit-on-error'] = config.get('exit-on-error', True)
+
+        # drive file metadata resolved in bulk and local paths of downloaded drive files, keyed by drive file id
+        self._context['drive-files'] = {}
+        self._context['drive-downloads'] = {}
+
+        # downloaded media is kept across runs, revalidated with the server and evicted least-recently-used beyond the size budget
+        self._context['media-cache'] = MediaCache(os.path.join(config['dirs']['temp-dir'], 'media'), config.get('media-cache-max-megabytes', 2048) * 1024 * 1024, config.get('media-cache-ttl-seconds', 0))
+
     def process_gsheet(self, gsheet_name, parent=None):
-        wait_for = self._context['gsheet-read-wait-seconds']
-        try_count = self._context['gsheet-read-try-count']
-        gsheet = None
-        for i in range(0, try_count):
-            try:
-                gsheet = self._context['_G'].open(gsheet_name)
-                break
-            except:
-                warn('gsheet read request (attempt {0}) failed, waiting for {1} seconds before trying again'.format(i, wait_for))
-                time.sleep(float(wait_for))
-
-        if gsheet is None:
+        try:
+            loaded = load_gsheet(self._context, gsheet_name)
+        except:
+            if not self._context['exit-on-error']:
+                error('gsheet read request failed for {0}'.format(gsheet_name))
+                raise
+
             error('gsheet read request failed, quiting')
             sys.exit(1)
 
-        return process_sheet(self._context, gsheet, parent)
+        return process_sheet(self._context, loaded, parent)
+
+    def retry_stats(self):
+        return self._context['retry-policy'].stats()
+
+    def http_stats(self):
+        return self._context['http-client'].stats()
+
+    def shutdown(self):
+        # the media cache index is written in batches, whatever has not been written yet is
+        self._context['media-cache'].close()
 
     def update_gsheets(self, data):
         update_sheets(self._context, data)
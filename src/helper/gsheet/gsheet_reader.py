@@ -2,6 +2,7 @@
 '''
 '''
 from collections import defaultdict
+from concurrent.futures import Future
 
 import re
 import importlib
@@ -12,25 +13,126 @@ import pygsheets
 import urllib.request
 
 from helper.logger import *
+from helper.tracer import span
 from helper.gsheet.gsheet_util import *
+from helper.gsheet.gsheet_cache import *
+from helper.gdrive.gdrive_util import drive_file_id
+
+def load_gsheet(context, gsheet_name):
+    '''
+        opens the gsheet, reads its index and fetches the worksheets it refers to - the gsheets embedded in it (and theirs) are loaded concurrently, level by level
+        every gsheet is loaded once for the whole run, however many parents embed it
+    '''
+    loaded = load_one(context, gsheet_name)
+
+    pending = child_gsheets(loaded['toclist'])
+    while len(pending) > 0:
+        pending = [name for name in dict.fromkeys(pending) if name not in context['gsheet-ids']]
+        results = context['gsheet-engine'].map(lambda name: load_one(context, name), pending)
+        pending = [name for result in results for name in child_gsheets(result['toclist'])]
+
+    return loaded
+
+def load_one(context, gsheet_name):
+    # gsheets built at the same time (batch builds) may embed the same child gsheet, whoever asks first loads it and the others wait for the result
+    with context['gsheet-lock']:
+        loading = context['gsheet-loading'].get(gsheet_name)
+        loader = loading is None
+        if loader:
+            loading = Future()
+            context['gsheet-loading'][gsheet_name] = loading
+
+    # the lock is only held for the lookup, waiting for a child under it would hold up every other gsheet being loaded
+    if not loader:
+        return loading.result()
+
+    try:
+        loaded = open_and_prefetch(context, gsheet_name)
+    except BaseException as e:
+        loading.set_exception(e)
+        raise
+
+    loading.set_result(loaded)
+    return loaded
+
+def open_and_prefetch(context, gsheet_name):
+    # gsheet-memo is keyed by spreadsheet id, gsheet-ids maps the names we were asked for to the id
+    if gsheet_name in context['gsheet-ids']:
+        return context['gsheet-memo'][context['gsheet-ids'][gsheet_name]]
+
+    info('loading gsheet ... {0}'.format(gsheet_name))
+    client = thread_gsheets_client(context)
+    with span('gsheet-open', gsheet=gsheet_name):
+        # opening by title is a drive query, it counts against the quota like any other read
+        sheet = throttled_call(lambda: client.open(gsheet_name), context, 'gsheet open request for {0}'.format(gsheet_name))
+
+    if sheet.id not in context['gsheet-memo']:
+        context['worksheet-cache'].setdefault(sheet.title, {})
+
+        # one metadata call tells us whether the worksheets cached on disk from an earlier run are still valid
+        validate_cache(sheet, context)
+
+        # titles, gids and sizes of all worksheets - every existence check and link resolution from here on is a lookup
+        build_index(sheet, context)
+
+        ws = worksheet_meta(sheet, context['index-worksheet'], context)
+        if ws is None:
+            raise pygsheets.WorksheetNotFound(context['index-worksheet'])
+
+        # the index is read through the values api (throttled and retried like every other read), rows come back without trailing empty cells
+        with span('index-read', gsheet=sheet.title) as attrs:
+            request = context['service'].spreadsheets().values().get(spreadsheetId=sheet.id, range='{0}!A3:U{1}'.format(a1_title(ws.title), ws.rows), majorDimension='ROWS')
+            toclist = execute_request(request, context, 'index read request for {0}'.format(sheet.title)).get('values', [])
+            attrs['rows'] = len(toclist)
+        toclist = [toc + [''] * (21 - len(toc)) for toc in toclist]
+        toclist = [toc for toc in toclist if toc[2] == 'Yes' and toc[3] in ['0', '1', '2', '3', '4', '5', '6']]
+
+        # fetch all the worksheets the sections (and their own headers/footers) refer to in as few requests as possible, parents overriding headers/footers just do not use some of them
+        module = importlib.import_module('processor.table_processor')
+        with span('prefetch', gsheet=sheet.title):
+            module.prefetch(sheet, worksheet_links(toclist), context, drive_links(toclist))
 
-def process_sheet(context, sheet, parent=None):
-    data = {}
+        context['gsheet-memo'][sheet.id] = {'sheet': sheet, 'toclist': toclist}
+
+    context['gsheet-ids'][gsheet_name] = sheet.id
+    return context['gsheet-memo'][sheet.id]
+
+def drive_links(toclist):
+    # ids of the drive files (pdf/docx sections) the index refers to
+    ids = []
+    for s in toclist:
+        if s[5] == '' or s[5] is None:
+            continue
+
+        if (s[4] == 'pdf' and s[5].startswith('https://drive.google.com/file/d/')) or s[4] == 'docx':
+            ids.append(drive_file_id(s[5]))
 
-    # worksheet-cache is nested dictionary of sheet->worksheet as two different sheets may have worksheets of same name, so keying by only worksheet name is not feasible
-    if 'worksheet-cache' not in context:
-        context['worksheet-cache'] = {}
+    return ids
 
-    if sheet.title not in context['worksheet-cache']:
-        context['worksheet-cache'][sheet.title] = {}
+def child_gsheets(toclist):
+    return [s[5] for s in toclist if s[4] == 'gsheet' and s[5] != '' and s[5] is not None]
 
-    ws_title = context['index-worksheet']
-    ws = sheet.worksheet('title', ws_title)
-    toclist = ws.get_values(start='A3', end='U{}'.format(ws.rows), returnas='matrix', majdim='ROWS', include_tailing_empty=True, include_tailing_empty_rows=False)
-    toclist = [toc for toc in toclist if toc[2] == 'Yes' and toc[3] in ['0', '1', '2', '3', '4', '5', '6']]
-    data['sections'] = [process_section(sheet, s, context, parent) for s in toclist]
+def process_sheet(context, loaded, parent=None):
+    '''
+        builds the sections of a loaded gsheet, the worksheets are already fetched so this is all cache lookups, header/footer overrides of the parent are applied here
+    '''
+    data = {}
+    data['sections'] = [process_section(loaded['sheet'], s, context, parent) for s in loaded['toclist']]
     return data
 
+def worksheet_links(toclist):
+    # all worksheets referred from the index - contents of table sections and headers/footers
+    links = []
+    for s in toclist:
+        if s[4] == 'table':
+            links.append(s[5])
+
+        different_first_page = s[9] == 'Yes'
+        links = links + ([s[10]] if different_first_page else []) + [s[11], s[12]]
+        links = links + ([s[13]] if different_first_page else []) + [s[14], s[15]]
+
+    return [link for link in links if link != '' and link is not None]
+
 def process_section(sheet, s, context, parent=None):
     # transform to a dict
     d = {
@@ -1,26 +1,96 @@
 #!/usr/bin/env python3
 
 import re
+import sys
 import os.path
+import threading
+from collections import namedtuple
 from os import path
 
-import urllib3
+import httplib2
 
 import pygsheets
 import urllib.request
 from PIL import Image
 
 from helper.logger import *
+from helper.tracer import span
 
 COLUMNS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
 
-def worksheet_exists(sheet, ws_title):
+# httplib2.Http is not thread-safe, so api requests executed from fetch-engine threads get an authorized Http of their own
+_thread_local = threading.local()
+
+def thread_http(context):
+    if getattr(_thread_local, 'http', None) is None:
+        _thread_local.http = context['credentials'].authorize(context['new-http']())
+
+    return _thread_local.http
+
+def thread_gsheets_client(context):
+    # the same goes for the pygsheets client, gsheets opened from different threads (child gsheets are loaded concurrently) each use their own
+    if getattr(_thread_local, 'gsheets', None) is None:
+        _thread_local.gsheets = pygsheets.authorize(service_account_file=context['google-cred'], http=context['new-http']())
+
+    return _thread_local.gsheets
+
+def throttled_call(fn, context, description):
+    # google api calls made by the readers are throttled by the fetch-engine (every attempt takes a token) and retried by the retry-policy
+    def call():
+        context['fetch-engine'].throttle()
+        return fn()
+
+    return context['retry-policy'].call(call, description)
+
+def execute_request(request, context, description='gsheet read request'):
     try:
-        ws = sheet.worksheet('title', ws_title)
-        return True
+        return throttled_call(lambda: request.execute(http=thread_http(context)), context, description)
     except:
+        if not context['exit-on-error']:
+            error('{0} failed'.format(description))
+            raise
+
+        error('{0} failed, quiting'.format(description))
+        sys.exit(1)
+
+# what we need to know about a worksheet to check for it, resolve links to it and fetch it
+WorksheetMeta = namedtuple('WorksheetMeta', ['id', 'title', 'rows', 'cols'])
+
+def build_index(sheet, context):
+    '''
+        titles, gids and grid sizes of all the worksheets of a spreadsheet, kept in context['sheet-index'] by spreadsheet id
+        pygsheets has already fetched this metadata when the spreadsheet was opened, so building the index costs no request
+    '''
+    index = {'titles': {}, 'gids': {}}
+    for ws in sheet.worksheets():
+        meta = WorksheetMeta(ws.id, ws.title, ws.rows, ws.cols)
+        index['titles'][meta.title] = meta
+        index['gids'][str(meta.id)] = meta
+
+    context['sheet-index'][sheet.id] = index
+    return index
+
+def worksheet_meta(sheet, ws_title, context):
+    # None (with a warning) if there is no such worksheet
+    meta = context['sheet-index'][sheet.id]['titles'].get(ws_title)
+    if meta is None:
         warn('No worksheet ... {0}'.format(ws_title))
-        return False
+
+    return meta
+
+def linked_worksheet(sheet, ws_gid, ws_title, context):
+    # the worksheet a =HYPERLINK("#gid=...", "...") points to, the gid decides and the link text is used only when the gid is not known
+    m = re.match(r'\d+', ws_gid)
+    if m:
+        meta = context['sheet-index'][sheet.id]['gids'].get(m.group(0))
+        if meta is not None:
+            return meta
+
+    return worksheet_meta(sheet, ws_title, context)
+
+def a1_title(ws_title):
+    # worksheet title as it must appear in an A1 range
+    return "'{0}'".format(ws_title.replace("'", "''"))
 
 def hex_to_rgba(color_hex):
     color = tuple(int(color_hex[i:i+2], 16) for i in (0, 2, 4, 6))
@@ -155,7 +225,7 @@ def init_worksheet(sheet, ws_title, num_rows=100, num_cols=4, frozen_rows=2, fro
 
     return ws
 
-def download_image(image_formula, tmp_dir, row_height):
+def image_url_and_suffix(image_formula):
     '''
         image_formula liiks like
         "http://documents.biasl.net/data/projects/rhd/filling-station-367x221.png", 3'\
@@ -163,35 +233,27 @@ def download_image(image_formula, tmp_dir, row_height):
         "http://documents.biasl.net/data/res/logo/rhd-logo-200x200.png", 4, 150, 150
     '''
     s = image_formula.replace('"', '').split(',')
-    url, local_path, mode = None, None, None
 
     # the first item is url
-    if len(s) >= 1:
-        url = s[0]
+    url = s[0]
 
-        # localpath is the last term if it ends with png/jpg/gif, if not
-        url_splitted = url.split('/')
-        if url_splitted[-1].endswith('.png') or url_splitted[-1].endswith('.jpg') or url_splitted[-1].endswith('.gif'):
-            local_path = '{0}/{1}'.format(tmp_dir, url_splitted[-1])
+    # the file type comes from the last term if it ends with png/jpg/gif, if not
+    url_splitted = url.split('/')
+    if url_splitted[-1].endswith('.png') or url_splitted[-1].endswith('.jpg') or url_splitted[-1].endswith('.gif'):
+        suffix = url_splitted[-1][-4:]
 
-        # if it is owncloud, (https://storage.brilliant.com.bd/s/IPO46mdbcetahMf/download) we use the penaltimate term and append a .png
-        elif len(url_splitted) >= 6 and 'storage.brilliant.com.bd' in url_splitted[2]:
-                local_path = '{0}/{1}.png'.format(tmp_dir, url_splitted[-2])
+    # if it is owncloud, (https://storage.brilliant.com.bd/s/IPO46mdbcetahMf/download) it is a .png
+    elif len(url_splitted) >= 6 and 'storage.brilliant.com.bd' in url_splitted[2]:
+            suffix = '.png'
 
-        else:
-            warn('.... url pattern unknown for file: {0}'.format(url))
-            return None
-
-        # download image in url into localpath
-        try:
-            # if the image is already in the local_path, we do not download it
-            if path.exists(local_path):
-                pass
-            else:
-                urllib.request.urlretrieve(url, local_path)
-        except:
-            warn('.... could not download file: {0}'.format(url))
-            return None
+    else:
+        warn('.... url pattern unknown for file: {0}'.format(url))
+        return None, None
+
+    return url, suffix
+
+def image_spec(image_formula, url, local_path, row_height):
+    s = image_formula.replace('"', '').split(',')
 
     # get the image dimensions
     try:
@@ -234,7 +296,33 @@ def download_image(image_formula, tmp_dir, row_height):
         info('.... image link does not specify height and width: {0}'.format(image_formula))
         return None
 
-def download_pdf_from_web(url, tmp_dir):
+def download_images(images, context):
+    '''
+        images is a list of (image_formula, row_height), returns a list of image specs (or None where the image could not be had) in the same order
+        all distinct urls are fetched concurrently through the media-cache which only downloads what is new or changed
+    '''
+    locations = [image_url_and_suffix(image_formula) for image_formula, row_height in images]
+
+    downloads = {url: suffix for url, suffix in locations if url is not None}
+    local_paths = {}
+    if len(downloads) > 0:
+        info('.... fetching {0} image(s)'.format(len(downloads)))
+        urls = list(downloads.keys())
+        with span('image-downloads', images=len(urls)):
+            results = context['download-engine'].map(lambda url: context['media-cache'].fetch_url(url, downloads[url], context['http-client']), urls)
+        local_paths = dict(zip(urls, results))
+
+    specs = []
+    for (image_formula, row_height), (url, suffix) in zip(images, locations):
+        local_path = local_paths.get(url)
+        if local_path is None:
+            specs.append(None)
+        else:
+            specs.append(image_spec(image_formula, url, local_path, row_height))
+
+    return specs
+
+def download_pdf_from_web(url, context):
     pdf_url = url.strip()
     if pdf_url[-4:] != '.pdf':
         error('.... url {0} is NOT a pdf file'.format(pdf_url))
@@ -242,59 +330,21 @@ def download_pdf_from_web(url, tmp_dir):
 
     pdf_name = pdf_url.split('/')[-1].strip()
 
-    # download pdf in url into localpath
-    try:
-        local_path = '{0}/{1}'.format(tmp_dir, pdf_name)
-        # if the pdf is already in the local_path, we do not download it
-        if path.exists(local_path):
-            pass
-        else:
-            urllib.request.urlretrieve(pdf_url, local_path)
-            info('.... {0} downloaded at: {1}'.format(pdf_url, local_path))
-
-        return {'pdf_name': pdf_name, 'pdf_path': local_path}
-    except:
+    # download pdf in url into the media-cache
+    with span('pdf-download', url=pdf_url):
+        local_path = context['media-cache'].fetch_url(pdf_url, '.pdf', context['http-client'])
+    if local_path is None:
         error('.... could not download pdf: {0}'.format(pdf_url))
         return None
 
-def download_pdf_from_drive(url, tmp_dir, drive):
-    pdf_url = url.strip()
-
-    id = pdf_url.replace('https://drive.google.com/file/d/', '')
-    id = id.split('/')[0]
-    info('drive file id to be downloaded is {0}'.format(id))
-    f = drive.CreateFile({'id': id})
-    if f['mimeType'] != 'application/pdf':
-        warn('drive url {0} is not a pdf'.format(url))
-        return None
-
-    pdf_name = f['title']
-    if not pdf_name.endswith('.pdf'):
-        pdf_name = pdf_name + '.pdf'
-
-    try:
-        local_path = '{0}/{1}'.format(tmp_dir, pdf_name)
-        # if the pdf is already in the local_path, we do not download it
-        if path.exists(local_path):
-            pass
-        else:
-            f.GetContentFile(local_path)
-            info('.... {0} downloaded at: {1}'.format(url, local_path))
-
-        return {'pdf_name': pdf_name, 'pdf_path': local_path}
-    except:
-        error('.... could not download pdf: {0}'.format(pdf_url))
-        return None
+    return {'pdf_name': pdf_name, 'pdf_path': local_path}
 
-def read_web_content(web_url):
+def read_web_content(web_url, context):
     url = web_url.strip()
 
-    # read content from url
+    # read content from url, the same include within a short time is read only once
     try:
-        http = urllib3.PoolManager()
-        response = http.request('GET', url)
-        text = response.data.decode('utf-8')
-        return text
+        return context['http-client'].get_text(url)
     except:
         error('.... could not read content from url: {0}'.format(web_url))
         return None
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+'''
+the compact form of a fetched worksheet the renderers work on - table_processor.process converts a spreadsheets.get response (once its images and
+nested worksheets are filled in) into a Worksheet and the response itself is dropped
+
+cells are slotted objects, notes are parsed once into Directives, effective formats are interned (cells having the same format share one CellFormat,
+a renderer works out what it needs from a format once and keeps it in the format's rendered slot) and the rows are segmented into table and out-of-cell
+segments up front
+
+to_dict gives the response back (with the same keys), that is what goes into json snapshots and fragment fingerprints - from_dict reads it back
+'''
+
+import json
+
+# effective format (as json) -> CellFormat, for the whole run
+FORMATS = {}
+
+class Directives(object):
+    '''
+        what a json note of a cell asks for - style, page-number, new-page, keep-with-next, content, table-spacing and repeat-rows
+    '''
+    __slots__ = ('style', 'page_number', 'new_page', 'keep_with_next', 'out_of_cell', 'table_spacing', 'repeat_rows')
+
+    def __init__(self, note_json):
+        self.style = note_json.get('style')
+        self.page_number = note_json.get('page-number')
+        self.new_page = 'new-page' in note_json
+        self.keep_with_next = 'keep-with-next' in note_json
+        self.out_of_cell = note_json.get('content') == 'out-of-cell'
+        self.table_spacing = note_json.get('table-spacing', '')
+        self.repeat_rows = int(note_json['repeat-rows']) if 'repeat-rows' in note_json else 0
+
+# cells without a (json) note
+NO_DIRECTIVES = Directives({})
+
+def directives(note):
+    # a note may be a json, if it is not it is just a note
+    if note is None:
+        return NO_DIRECTIVES
+
+    try:
+        note_json = json.loads(note)
+    except json.JSONDecodeError:
+        return NO_DIRECTIVES
+
+    if not isinstance(note_json, dict):
+        return NO_DIRECTIVES
+
+    return Directives(note_json)
+
+class CellFormat(object):
+    '''
+        an effective format of the worksheet, formats are equal if their effective formats are
+    '''
+    __slots__ = ('effective', 'key', 'valign', 'halign', 'rotated', 'rendered')
+
+    def __init__(self, effective, key):
+        self.effective = effective
+        self.key = key
+        self.valign = effective.get('verticalAlignment')
+        self.halign = effective.get('horizontalAlignment')
+        self.rotated = 'textRotation' in effective
+
+        # what the renderer works out from the format (see docx_util.docx_format), it is not pickled
+        self.rendered = None
+
+    def __eq__(self, other):
+        return isinstance(other, CellFormat) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __getstate__(self):
+        return self.effective, self.key
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+def cell_format(effective):
+    key = json.dumps(effective, sort_keys=True)
+    format = FORMATS.get(key)
+    if format is None:
+        format = FORMATS.setdefault(key, CellFormat(effective, key))
+
+    return format
+
+# keys of a cell's response the Cell has a slot for, anything else (asked for through gsheet-cell-fields) is kept as it is
+CELL_KEYS = ['formattedValue', 'note', 'textFormatRuns', 'userEnteredValue', 'effectiveFormat', 'contents']
+
+class Cell(object):
+    __slots__ = ('text', 'note', 'directives', 'format', 'runs', 'value', 'contents', 'extra')
+
+    def __init__(self, cell_data):
+        self.text = cell_data.get('formattedValue')
+        self.note = cell_data.get('note')
+        self.directives = directives(self.note)
+        self.format = cell_format(cell_data['effectiveFormat']) if 'effectiveFormat' in cell_data else None
+        self.runs = cell_data.get('textFormatRuns')
+        self.value = cell_data.get('userEnteredValue')
+        self.contents = cell_data.get('contents')
+        if isinstance(self.contents, dict) and 'sheets' in self.contents:
+            self.contents = Worksheet.from_dict(self.contents)
+
+        extra = {k: v for k, v in cell_data.items() if k not in CELL_KEYS}
+        self.extra = extra if len(extra) > 0 else None
+
+    @property
+    def image(self):
+        # the image spec table_processor filled in for an =IMAGE(...) formula
+        return self.value.get('image') if self.value is not None else None
+
+    def to_dict(self):
+        cell_data = {}
+        if self.text is not None: cell_data['formattedValue'] = self.text
+        if self.note is not None: cell_data['note'] = self.note
+        if self.runs is not None: cell_data['textFormatRuns'] = self.runs
+        if self.value is not None: cell_data['userEnteredValue'] = self.value
+        if self.format is not None: cell_data['effectiveFormat'] = self.format.effective
+        if self.contents is not None: cell_data['contents'] = self.contents.to_dict() if isinstance(self.contents, Worksheet) else self.contents
+        if self.extra is not None: cell_data.update(self.extra)
+        return cell_data
+
+# cells with nothing in them are all the same cell
+EMPTY_CELL = Cell({})
+
+def cell(cell_data):
+    return EMPTY_CELL if len(cell_data) == 0 else Cell(cell_data)
+
+class Worksheet(object):
+    __slots__ = ('spreadsheet_id', 'properties', 'merges', 'start_row', 'start_col', 'row_metadata', 'column_metadata', 'rows', 'segments')
+
+    @classmethod
+    def from_dict(cls, response):
+        '''
+            the worksheet of a (processed) spreadsheets.get response for one worksheet
+        '''
+        ws = cls()
+        sheet = response['sheets'][0]
+        data = sheet['data'][0]
+        ws.spreadsheet_id = response.get('spreadsheetId')
+        ws.properties = sheet['properties']
+        ws.merges = sheet.get('merges')
+        ws.start_row = data['startRow']
+        ws.start_col = data['startColumn']
+        ws.row_metadata = data.get('rowMetadata')
+        ws.column_metadata = data.get('columnMetadata')
+
+        # rows without values are None
+        ws.rows = [[cell(cell_data) for cell_data in row_data['values']] if 'values' in row_data else None for row_data in data['rowData']]
+        ws.segments = ws.row_segments()
+        return ws
+
+    @property
+    def row_count(self):
+        return self.properties['gridProperties']['rowCount']
+
+    @property
+    def col_count(self):
+        return self.properties['gridProperties']['columnCount']
+
+    def first_cell(self, row_num):
+        # the cell in the first column of worksheet row row_num (1 based)
+        return self.rows[row_num - self.start_row - 1][0]
+
+    def row_segments(self):
+        '''
+            [(segment type, first row, last row)] of worksheet rows (1 based), a segment is a 'table' or an out-of-cell row ('no-table')
+
+            in-cell content goes inside a table cell, out-of-cell content (a row whose first cell has a note with 'content': 'out-of-cell') goes directly
+            into the doc - rows before an out-of-cell row go in one table and rows after it go into another
+        '''
+        segments = []
+        start_at_row = self.start_row + 1
+        for row_num in range(self.start_row + 1, self.row_count + 1):
+            row = self.rows[row_num - self.start_row - 1]
+            if row is None or len(row) == 0 or not row[0].directives.out_of_cell:
+                continue
+
+            if row_num > start_at_row:
+                segments.append(('table', start_at_row, row_num - 1))
+
+            segments.append(('no-table', row_num, row_num))
+            start_at_row = row_num + 1
+
+        # there may be trailing rows after the last out-of-cell content row, they will merge into a table
+        if start_at_row <= self.row_count:
+            segments.append(('table', start_at_row, self.row_count))
+
+        return segments
+
+    def cells(self):
+        for row in self.rows:
+            if row is not None:
+                yield from row
+
+    def to_dict(self):
+        data = {'startRow': self.start_row, 'startColumn': self.start_col}
+        if self.row_metadata is not None: data['rowMetadata'] = self.row_metadata
+        if self.column_metadata is not None: data['columnMetadata'] = self.column_metadata
+        data['rowData'] = [{'values': [cell_data.to_dict() for cell_data in row]} if row is not None else {} for row in self.rows]
+
+        sheet = {'properties': self.properties}
+        if self.merges is not None: sheet['merges'] = self.merges
+        sheet['data'] = [data]
+
+        response = {}
+        if self.spreadsheet_id is not None: response['spreadsheetId'] = self.spreadsheet_id
+        response['sheets'] = [sheet]
+        return response
+
+def json_default(o):
+    # for json.dumps, worksheets are dumped as the responses they come from
+    if isinstance(o, Worksheet):
+        return o.to_dict()
+
+    return str(o)
+
+def json_object_hook(d):
+    # for json.load, responses are read back as worksheets
+    if 'sheets' in d:
+        return Worksheet.from_dict(d)
+
+    return d
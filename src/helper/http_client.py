@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''
+the one http client all outbound web fetches (images, pdfs, text includes) go through
+keep-alive connections are pooled per host (at most per_host connections to a host at a time), every request has connect/read timeouts,
+bodies are streamed to disk in chunks, gzip is asked for and decoded, text includes are cached for ttl seconds and bytes/latency are counted per host
+'''
+import time
+import threading
+
+from urllib.parse import urlsplit
+
+import urllib3
+
+from helper.logger import *
+from helper.tracer import span
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_HEADERS = {'Accept-Encoding': 'gzip, deflate'}
+
+class HttpClient(object):
+
+    def __init__(self, per_host, connect_timeout, read_timeout, text_ttl_seconds=300, text_cache_entries=128):
+        timeout = urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+        # block=True makes maxsize a per-host limit on concurrent connections instead of opening throw-away connections beyond it
+        self._pool = urllib3.PoolManager(num_pools=50, maxsize=per_host, block=True, timeout=timeout)
+
+        self._text_ttl_seconds = text_ttl_seconds
+        self._text_cache_entries = text_cache_entries
+        self._text_cache = {}
+
+        self._lock = threading.Lock()
+        self._host_stats = {}
+
+    def download(self, url, path, headers=None):
+        '''
+            GETs url and streams the body into path if the response is a 200, returns (status, response headers)
+        '''
+        with span('http-download', host=urlsplit(url).netloc) as attrs:
+            start_time = time.monotonic()
+            response = self._pool.request('GET', url, headers=dict(DEFAULT_HEADERS, **(headers or {})), preload_content=False)
+            try:
+                if response.status == 200:
+                    with open(path, 'wb') as f:
+                        for chunk in response.stream(CHUNK_SIZE):
+                            f.write(chunk)
+                else:
+                    response.drain_conn()
+
+                self.count(url, response.tell(), time.monotonic() - start_time)
+                attrs['status'] = response.status
+                attrs['bytes'] = response.tell()
+                return response.status, response.headers
+            finally:
+                response.release_conn()
+
+    def get_text(self, url, encoding='utf-8'):
+        '''
+            the body of url as text, a text fetched within the last ttl seconds is not fetched again
+        '''
+        now = time.monotonic()
+        with self._lock:
+            cached = self._text_cache.get(url)
+            if cached is not None and now - cached[0] < self._text_ttl_seconds:
+                return cached[1]
+
+        start_time = time.monotonic()
+        response = self._pool.request('GET', url, headers=DEFAULT_HEADERS)
+        self.count(url, response.tell(), time.monotonic() - start_time)
+        if response.status != 200:
+            raise urllib3.exceptions.HTTPError('{0} returned status {1}'.format(url, response.status))
+
+        text = response.data.decode(encoding)
+        with self._lock:
+            # the oldest entry makes room for the new one
+            if url not in self._text_cache and len(self._text_cache) >= self._text_cache_entries:
+                del self._text_cache[min(self._text_cache, key=lambda key: self._text_cache[key][0])]
+
+            self._text_cache[url] = (now, text)
+
+        return text
+
+    def count(self, url, num_bytes, seconds):
+        host = urlsplit(url).netloc
+        with self._lock:
+            stats = self._host_stats.setdefault(host, {'requests': 0, 'bytes': 0, 'seconds': 0.0})
+            stats['requests'] = stats['requests'] + 1
+            stats['bytes'] = stats['bytes'] + num_bytes
+            stats['seconds'] = stats['seconds'] + seconds
+
+    def stats(self):
+        # per host request count, bytes on the wire and total latency (seconds from request to the last byte)
+        with self._lock:
+            return {host: {'requests': s['requests'], 'bytes': s['bytes'], 'seconds': round(s['seconds'], 3)} for host, s in self._host_stats.items()}
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+'''
+content-addressed store for downloaded media (images, pdfs, drive files) under tmp-dir/media
+files are named by the hash of what they were downloaded from (url or drive file id), a sidecar index.json keeps etag/last-modified/size/last-use of every entry
+entries are revalidated with conditional requests (or reused without asking while younger than ttl-seconds) and the least recently used entries are evicted when the store grows beyond max-bytes
+the index is written every SAVE_EVERY changes and when the cache is closed, files it does not know about (a run that did not get to write it) are removed on start
+'''
+import os
+import json
+import time
+import hashlib
+import threading
+
+from helper.logger import *
+from helper.tracer import span
+
+SAVE_EVERY = 50
+
+class MediaCache(object):
+
+    def __init__(self, root, max_bytes, ttl_seconds=0):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._index_path = os.path.join(root, 'index.json')
+        self._lock = threading.Lock()
+
+        # entries used in this run are never evicted, the docx being built still needs them
+        self._in_use = set()
+
+        os.makedirs(root, exist_ok=True)
+        self._index = {}
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except:
+                warn('media cache index {0} is not readable, starting with an empty cache'.format(self._index_path))
+
+        # downloads of a run that ended before the index was written (and their .part files) are not in the index
+        self._index = {key: entry for key, entry in self._index.items() if os.path.exists(entry['path'])}
+        known = set(os.path.basename(entry['path']) for entry in self._index.values()) | {os.path.basename(self._index_path)}
+        for name in os.listdir(root):
+            if name not in known:
+                os.remove(os.path.join(root, name))
+
+        self._total = sum(entry['size'] for entry in self._index.values())
+        self._changes = 0
+
+        # the budget may have been lowered since the last run
+        with self._lock:
+            self.evict()
+            self.save_index()
+
+    def path_for(self, key, suffix=''):
+        return os.path.join(self._root, '{0}{1}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest(), suffix))
+
+    def fetch_url(self, url, suffix, http):
+        '''
+            returns the local path of url, downloading it only if we do not have it or the server says it has changed
+        '''
+        local_path = self.path_for(url, suffix)
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is not None and not os.path.exists(local_path):
+                entry = None
+
+        headers = {}
+        if entry is not None:
+            if self._ttl_seconds > 0 and time.time() - entry['validated'] < self._ttl_seconds:
+                with self._lock:
+                    self.use(url, entry)
+                return local_path
+
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last-modified'):
+                headers['If-Modified-Since'] = entry['last-modified']
+
+        temp_path = '{0}.{1}.part'.format(local_path, threading.get_ident())
+        try:
+            status, response_headers = http.download(url, temp_path, headers)
+            if status == 304 and entry is not None:
+                with self._lock:
+                    entry['validated'] = time.time()
+                    self.use(url, entry)
+                    self.changed()
+                return local_path
+
+            if status != 200:
+                warn('.... could not download file: {0} (status {1})'.format(url, status))
+                return None
+
+            os.replace(temp_path, local_path)
+            info('.... {0} downloaded at: {1}'.format(url, local_path))
+        except:
+            warn('.... could not download file: {0}'.format(url))
+            return None
+        finally:
+            # what a failed (or not modified) download has written so far
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.put(url, local_path, {'etag': response_headers.get('ETag'), 'last-modified': response_headers.get('Last-Modified')})
+        return local_path
+
+    def fetch_drive_file(self, drive_file, suffix=''):
+        '''
+            drive_file is a pydrive file with metadata, its md5Checksum (or modifiedDate for google docs) tells us whether what we have is still current
+        '''
+        key = 'drive:{0}'.format(drive_file['id'])
+        version = drive_file.get('md5Checksum') or drive_file.get('modifiedDate')
+        local_path = self.path_for(key, suffix)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and entry.get('version') == version and version is not None and os.path.exists(local_path):
+                entry['validated'] = time.time()
+                self.use(key, entry)
+                self.changed()
+                return local_path
+
+        temp_path = '{0}.{1}.part'.format(local_path, threading.get_ident())
+        try:
+            with span('drive-download', id=drive_file['id']) as attrs:
+                drive_file.GetContentFile(temp_path)
+                attrs['bytes'] = os.path.getsize(temp_path)
+
+            os.replace(temp_path, local_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        info('.... drive file {0} downloaded at: {1}'.format(drive_file['id'], local_path))
+
+        self.put(key, local_path, {'version': version})
+        return local_path
+
+    def put(self, key, local_path, validators):
+        with self._lock:
+            entry = {'path': local_path, 'size': os.path.getsize(local_path), 'validated': time.time()}
+            entry.update(validators)
+            if key in self._index:
+                self._total = self._total - self._index[key]['size']
+
+            self._index[key] = entry
+            self._total = self._total + entry['size']
+            self.use(key, entry)
+            self.evict()
+            self.changed()
+
+    def use(self, key, entry):
+        # callers hold the lock
+        entry['used'] = time.time()
+        self._in_use.add(key)
+
+    def evict(self):
+        # callers hold the lock, least recently used entries go first
+        if self._total <= self._max_bytes:
+            return
+
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1].get('used', 0)):
+            if self._total <= self._max_bytes:
+                break
+
+            if key in self._in_use:
+                continue
+
+            try:
+                os.remove(entry['path'])
+            except OSError:
+                pass
+
+            self._total = self._total - entry['size']
+            del self._index[key]
+            debug('.... evicted {0} from media cache'.format(key))
+
+    def changed(self):
+        # callers hold the lock, the index is written once every SAVE_EVERY changes rather than on every one
+        self._changes = self._changes + 1
+        if self._changes >= SAVE_EVERY:
+            self.save_index()
+
+    def save_index(self):
+        # callers hold the lock
+        temp_path = '{0}.part'.format(self._index_path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+
+        os.replace(temp_path, self._index_path)
+        self._changes = 0
+
+    def close(self):
+        # writes what has changed since the index was last written
+        with self._lock:
+            if self._changes > 0:
+                self.save_index()
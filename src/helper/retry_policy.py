@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+'''
+shared retry policy for google api (and other network) calls
+errors are classified as retryable (429, 5xx, timeouts, connection errors) or fatal (other 4xx, anything else), retryable errors are retried with
+exponential backoff and full jitter (honouring Retry-After) until the attempts or the time budget per request run out
+'''
+import ssl
+import time
+import random
+import socket
+import threading
+import http.client
+
+import httplib2
+
+from googleapiclient.errors import HttpError
+
+from helper.logger import *
+
+RETRYABLE_STATUS = [408, 429, 500, 502, 503, 504]
+RETRYABLE_ERRORS = (TimeoutError, socket.timeout, ConnectionError, http.client.HTTPException, httplib2.HttpLib2Error, ssl.SSLError)
+
+def http_error_of(e):
+    # pydrive wraps the HttpError in an ApiRequestError
+    if isinstance(e, HttpError):
+        return e
+
+    if len(e.args) > 0 and isinstance(e.args[0], HttpError):
+        return e.args[0]
+
+    return None
+
+def classify(e):
+    '''
+        returns (retryable, retry_after_seconds)
+    '''
+    http_error = http_error_of(e)
+    if http_error is not None:
+        status = int(http_error.resp.status)
+        retry_after = None
+        try:
+            retry_after = float(http_error.resp.get('retry-after'))
+        except (TypeError, ValueError):
+            pass
+
+        if status in RETRYABLE_STATUS:
+            return True, retry_after
+
+        # some google apis report quota errors as 403
+        if status == 403 and b'ratelimitexceeded' in (http_error.content or b'').lower():
+            return True, retry_after
+
+        return False, None
+
+    if isinstance(e, RETRYABLE_ERRORS):
+        return True, None
+
+    return False, None
+
+class RetryPolicy(object):
+
+    def __init__(self, max_attempts, base_seconds, max_seconds, deadline_seconds):
+        self._max_attempts = max_attempts
+        self._base_seconds = base_seconds
+        self._max_seconds = max_seconds
+        self._deadline_seconds = deadline_seconds
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+        self._failures = 0
+        self._sleep_seconds = 0.0
+
+    def call(self, fn, description='request'):
+        '''
+            calls fn until it succeeds, raises the last error if it is fatal or if attempts/time budget are exhausted
+        '''
+        with self._lock:
+            self._requests = self._requests + 1
+
+        start_time = time.monotonic()
+        for attempt in range(0, self._max_attempts):
+            try:
+                return fn()
+            except Exception as e:
+                retryable, retry_after = classify(e)
+                if not retryable:
+                    error('{0} failed with a non-retryable error: {1}'.format(description, e))
+                    self.count_failure()
+                    raise
+
+                wait_for = random.uniform(0, min(self._max_seconds, self._base_seconds * (2 ** attempt)))
+                if retry_after is not None:
+                    wait_for = max(wait_for, retry_after)
+
+                elapsed = time.monotonic() - start_time
+                if attempt + 1 == self._max_attempts or elapsed + wait_for > self._deadline_seconds:
+                    error('{0} failed after {1} attempt(s) in {2:.1f} seconds: {3}'.format(description, attempt + 1, elapsed, e))
+                    self.count_failure()
+                    raise
+
+                warn('{0} (attempt {1}) failed: {2}, waiting for {3:.1f} seconds before trying again'.format(description, attempt, e, wait_for))
+                with self._lock:
+                    self._retries = self._retries + 1
+                    self._sleep_seconds = self._sleep_seconds + wait_for
+
+                time.sleep(wait_for)
+
+    def count_failure(self):
+        with self._lock:
+            self._failures = self._failures + 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self._requests, 'retries': self._retries, 'failures': self._failures, 'sleep-seconds': round(self._sleep_seconds, 3)}
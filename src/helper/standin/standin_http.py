@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+'''
+client side of the google stand-in: google api urls are rewritten to go to the stand-in (see google-standin.py) instead of google
+https://sheets.googleapis.com/v4/spreadsheets/... becomes <endpoint>/sheets.googleapis.com/v4/spreadsheets/...
+'''
+import re
+
+import httplib2
+
+from pydrive.auth import GoogleAuth
+
+GOOGLE_URL = re.compile(r'^https://(?P<host>([a-z0-9-]+\.)*(googleapis\.com|google\.com))(?P<rest>/.*)?$')
+
+def standin_uri(endpoint, uri):
+    # urls of anything other than google are left as they are
+    m = GOOGLE_URL.match(uri)
+    if m is None:
+        return uri
+
+    return '{0}/{1}{2}'.format(endpoint.rstrip('/'), m.group('host'), m.group('rest') or '/')
+
+class StandinHttp(httplib2.Http):
+
+    def __init__(self, endpoint, **kwargs):
+        super().__init__(**kwargs)
+        self._endpoint = endpoint
+
+    def request(self, uri, *args, **kwargs):
+        return super().request(standin_uri(self._endpoint, uri), *args, **kwargs)
+
+class HttpFactoryAuth(GoogleAuth):
+    '''
+        pydrive creates a new httplib2.Http for every call, this makes it use new_http instead
+    '''
+    def __init__(self, new_http):
+        super().__init__()
+        self._new_http = new_http
+        self.http = new_http()
+
+    def Get_Http_Object(self):
+        return self.credentials.authorize(self._new_http())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+'''
+a local http stand-in for the google apis we use (sheets v4, drive v2/v3 through pygsheets, googleapiclient and pydrive)
+requests come in as <endpoint>/<google host>/<path>?<query> (see standin_http.py) and are answered from fixtures recorded earlier
+
+in record mode every request is forwarded to google, the response is returned and saved as a fixture
+in replay mode the fixtures are all there is, nothing goes to google - access tokens are made up and any assertion is accepted
+batch requests (multipart/mixed) are split and every part is answered on its own, so that fixtures do not depend on how requests were batched
+latency and errors (429/503) can be injected to see how the fetch path behaves against a slow or unreliable server
+'''
+import os
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import urllib3
+
+from helper.logger import *
+
+TOKEN_PATHS = ['/oauth2.googleapis.com/token', '/accounts.google.com/o/oauth2/token', '/oauth2.googleapis.com/oauth2/v4/token', '/www.googleapis.com/oauth2/v4/token']
+
+# made up tokens outlive any run, a token refresh in the middle of a run might not come through the stand-in (see gsheet_helper)
+TOKEN_LIFETIME_SECONDS = 7 * 24 * 3600
+
+# query parameters that do not change the response
+IGNORED_PARAMS = ['access_token', 'key', 'quotaUser', 'prettyPrint']
+
+# request/response headers that are not passed on (responses are recorded decoded)
+HOP_HEADERS = ['host', 'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'accept-encoding', 'content-encoding']
+
+class FixtureStore(object):
+    '''
+        fixtures are kept as <root>/<host>/<key>.json (method, path, query, status, headers) and <root>/<host>/<key>.body
+    '''
+    def __init__(self, root):
+        self._root = root
+        self._lock = threading.Lock()
+
+    def key(self, method, host, path, query, body):
+        params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k not in IGNORED_PARAMS)
+        text = '{0} {1}{2}?{3}'.format(method, host, path, urlencode(params))
+        if body:
+            text = text + ' ' + hashlib.sha1(body).hexdigest()
+
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def paths(self, host, key):
+        base = os.path.join(self._root, host, key)
+        return '{0}.json'.format(base), '{0}.body'.format(base)
+
+    def load(self, method, host, path, query, body):
+        meta_path, body_path = self.paths(host, self.key(method, host, path, query, body))
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        with open(body_path, 'rb') as f:
+            return meta['status'], meta['headers'], f.read()
+
+    def save(self, method, host, path, query, body, status, headers, response_body):
+        meta_path, body_path = self.paths(host, self.key(method, host, path, query, body))
+        meta = {'method': method, 'path': path, 'query': query, 'status': status, 'headers': headers}
+        with self._lock:
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            with open(body_path, 'wb') as f:
+                f.write(response_body)
+
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=4)
+
+class Standin(object):
+
+    def __init__(self, fixtures_dir, record=False, latency_ms=0, jitter_ms=0, error_rate=0.0):
+        self._fixtures = FixtureStore(fixtures_dir)
+        self._record = record
+        self._latency_ms = latency_ms
+        self._jitter_ms = jitter_ms
+        self._error_rate = error_rate
+        self._upstream = urllib3.PoolManager(num_pools=10, maxsize=8) if record else None
+
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def count(self, host, outcome):
+        with self._lock:
+            stats = self._stats.setdefault(host, {'requests': 0, 'missing': 0, 'injected-errors': 0})
+            stats['requests'] = stats['requests'] + 1
+            if outcome is not None:
+                stats[outcome] = stats[outcome] + 1
+
+    def stats(self):
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._stats.items()}
+
+    def respond(self, method, target, headers, body):
+        '''
+            (status, headers, body) for a request, target is /<host>/<path>?<query>
+        '''
+        parts = urlsplit(target)
+        m = re.match('^/(?P<host>[^/]+)(?P<path>/.*)?$', parts.path)
+        if m is None:
+            return json_response(400, {'error': {'code': 400, 'message': 'the path must start with a google host'}})
+
+        host = m.group('host')
+        path = m.group('path') or '/'
+
+        if parts.path in TOKEN_PATHS and not self._record:
+            return json_response(200, {'access_token': 'standin-{0}'.format(uuid.uuid4().hex), 'expires_in': TOKEN_LIFETIME_SECONDS, 'token_type': 'Bearer'})
+
+        if path.startswith('/batch/'):
+            return self.respond_batch(host, headers, body)
+
+        delay = (self._latency_ms + random.uniform(0, self._jitter_ms)) / 1000.0
+        if delay > 0:
+            time.sleep(delay)
+
+        if parts.path not in TOKEN_PATHS and random.random() < self._error_rate:
+            self.count(host, 'injected-errors')
+            if random.random() < 0.5:
+                status, response_headers, response_body = json_response(429, {'error': {'code': 429, 'message': 'Quota exceeded (injected by stand-in)', 'status': 'RESOURCE_EXHAUSTED'}})
+                response_headers['Retry-After'] = '1'
+                return status, response_headers, response_body
+
+            return json_response(503, {'error': {'code': 503, 'message': 'The service is currently unavailable (injected by stand-in)', 'status': 'UNAVAILABLE'}})
+
+        if self._record:
+            return self.forward(method, host, path, parts.query, headers, body)
+
+        fixture = self._fixtures.load(method, host, path, parts.query, body)
+        if fixture is None:
+            warn('stand-in has no fixture for {0} {1}{2}?{3}'.format(method, host, path, parts.query))
+            self.count(host, 'missing')
+            return json_response(404, {'error': {'code': 404, 'message': 'no stand-in fixture for this request', 'status': 'NOT_FOUND'}})
+
+        self.count(host, None)
+        return fixture
+
+    def forward(self, method, host, path, query, headers, body):
+        # the request goes to google as it is, token responses are passed through but never recorded
+        url = 'https://{0}{1}{2}'.format(host, path, '?' + query if query else '')
+        forward_headers = {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS}
+        response = self._upstream.request(method, url, body=body, headers=forward_headers, redirect=False)
+        response_headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS and k.lower() != 'set-cookie'}
+        self.count(host, None)
+
+        if '/{0}{1}'.format(host, path) not in TOKEN_PATHS:
+            self._fixtures.save(method, host, path, query, body, response.status, response_headers, response.data)
+            debug('recorded {0} {1}{2}'.format(method, host, path))
+
+        return response.status, response_headers, response.data
+
+    def respond_batch(self, host, headers, body):
+        '''
+            every part of a multipart/mixed batch is an http request of its own, the answers go back in the same order with matching content ids
+        '''
+        message = BytesParser(policy=HTTP).parsebytes('Content-Type: {0}\r\n\r\n'.format(headers.get('Content-Type')).encode('utf-8') + body)
+        boundary = 'batch_{0}'.format(uuid.uuid4().hex)
+        chunks = []
+        for part in message.iter_parts():
+            request_line, _, rest = part.get_payload(decode=True).partition(b'\r\n')
+            part_method, part_target, _ = request_line.decode('utf-8').split(' ', 2)
+            part_head, _, part_body = rest.partition(b'\r\n\r\n')
+            part_headers = dict(line.split(': ', 1) for line in part_head.decode('utf-8').split('\r\n') if ': ' in line)
+            if part_headers.get('Authorization') is None and headers.get('Authorization') is not None:
+                part_headers['Authorization'] = headers.get('Authorization')
+
+            part_url = urlsplit(part_target)
+            target = '/{0}{1}{2}'.format(host, part_url.path, '?' + part_url.query if part_url.query else '')
+            status, response_headers, response_body = self.respond(part_method, target, part_headers, part_body)
+
+            content_id = part['Content-ID'] or '<{0}>'.format(len(chunks))
+            lines = ['--{0}'.format(boundary), 'Content-Type: application/http', 'Content-ID: <response-{0}>'.format(content_id.strip('<>')), '', 'HTTP/1.1 {0} {1}'.format(status, 'OK' if status == 200 else 'Error')]
+            lines = lines + ['{0}: {1}'.format(k, v) for k, v in response_headers.items()] + ['', '']
+            chunks.append('\r\n'.join(lines).encode('utf-8') + response_body + b'\r\n')
+
+        response_body = b''.join(chunks) + '--{0}--\r\n'.format(boundary).encode('utf-8')
+        return 200, {'Content-Type': 'multipart/mixed; boundary={0}'.format(boundary)}, response_body
+
+def json_response(status, data):
+    return status, {'Content-Type': 'application/json; charset=UTF-8'}, json.dumps(data).encode('utf-8')
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status, headers, response_body = self.server.standin.respond(self.command, self.path, self.headers, body)
+
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(response_body)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_PATCH = handle_request
+    do_DELETE = handle_request
+    do_HEAD = handle_request
+
+    def log_message(self, format, *args):
+        debug('stand-in {0}'.format(format % args))
+
+def serve(standin, host='127.0.0.1', port=8765):
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.standin = standin
+    return server
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+'''
+phase-level tracing - a span records what was done (name and attributes like gsheet, worksheet, rows, cols, bytes), on which thread, when and for how long
+spans are exported as chrome trace events (load the file in chrome://tracing or ui.perfetto.dev) and summarised per name as a table
+
+usage:
+with span('worksheet-fetch', gsheet=sheet.title, worksheets=len(batch)) as attrs:
+    ...
+    attrs['bytes'] = len(content)
+'''
+import os
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+
+from helper.logger import *
+
+_lock = threading.Lock()
+_spans = []
+_origin = time.perf_counter()
+
+@contextmanager
+def span(name, **attrs):
+    # the attributes are yielded so that what is known only at the end (bytes, counts) can be added to them
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        end = time.perf_counter()
+        thread = threading.current_thread()
+        with _lock:
+            _spans.append((name, start - _origin, end - start, thread.ident, thread.name, attrs))
+
+def reset():
+    global _origin
+    with _lock:
+        _spans.clear()
+        _origin = time.perf_counter()
+
+def chrome_trace():
+    # complete events (ph X) in microseconds, plus a thread_name metadata event for every thread we have seen
+    pid = os.getpid()
+    with _lock:
+        spans = list(_spans)
+
+    events = []
+    threads = {}
+    for name, start, duration, tid, thread_name, attrs in spans:
+        threads[tid] = thread_name
+        events.append({'name': name, 'ph': 'X', 'ts': round(start * 1000000, 1), 'dur': round(duration * 1000000, 1), 'pid': pid, 'tid': tid, 'args': {k: str(v) if not isinstance(v, (int, float, bool)) else v for k, v in attrs.items()}})
+
+    for tid, thread_name in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(), f)
+
+    info('trace written to {0}'.format(path))
+
+def summary():
+    '''
+        [(name, count, total seconds, mean seconds, max seconds)] with the most expensive first
+        totals of spans running on several threads at the same time (fetches, downloads) add up to more than the time they took
+    '''
+    with _lock:
+        spans = list(_spans)
+
+    by_name = {}
+    for name, start, duration, tid, thread_name, attrs in spans:
+        by_name.setdefault(name, []).append(duration)
+
+    rows = [(name, len(durations), sum(durations), sum(durations) / len(durations), max(durations)) for name, durations in by_name.items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+def log_summary():
+    rows = summary()
+    if len(rows) == 0:
+        return
+
+    width = max(len(row[0]) for row in rows)
+    info('{0:<{1}} {2:>8} {3:>12} {4:>12} {5:>12}'.format('span', width, 'count', 'total (s)', 'mean (s)', 'max (s)'))
+    for name, count, total, mean, longest in rows:
+        info('{0:<{1}} {2:>8} {3:>12.3f} {4:>12.4f} {5:>12.4f}'.format(name, width, count, total, mean, longest))
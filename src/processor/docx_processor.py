@@ -4,10 +4,14 @@
 from helper.logger import *
 from helper.gdrive.gdrive_util import *
 
-def process(link, section_data, context):
-    docx_name = section_data['link']
+def process(sheet, section_data, context):
+    link = section_data['link']
     debug('downloading docx : {0}'.format(link))
-    local_path = '{0}/{1}.docx'.format(context['tmp-dir'], docx_name)
+    # the metadata has usually been resolved in bulk and the file downloaded already when the gsheet was loaded
+    local_path = drive_file_path(drive_file_id(link), context)
+    if local_path is None:
+        warn('could not download docx {0}'.format(link))
+        return {}
+
     debug('into             : {0}'.format(local_path))
-    download_drive_file({'id': link}, local_path, context)
     return {'docx-path': local_path}
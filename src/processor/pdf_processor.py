@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 '''
 '''
+import os
 import pdf2image
 import pdf2image.exceptions
 
 from helper.logger import *
 from helper.gsheet.gsheet_helper import GsheetHelper
 from helper.gsheet.gsheet_util import *
+from helper.gdrive.gdrive_util import *
 
 def process(sheet, section_data, context):
     hyperlink = section_data['link']
@@ -14,11 +16,11 @@ def process(sheet, section_data, context):
 
     if hyperlink.startswith('http') and hyperlink.endswith('.pdf'):
         # the pdf url is a normal web url
-        data = download_pdf_from_web(hyperlink, context['tmp-dir'])
+        data = download_pdf_from_web(hyperlink, context)
 
     elif hyperlink.startswith('https://drive.google.com/file/d/'):
         # the pdf is from gdrive
-        data = download_pdf_from_drive(hyperlink, context['tmp-dir'], context['drive'])
+        data = download_pdf_from_drive(hyperlink, context)
 
     else:
         warn('the pdf url {0} is not either a web or a gdrive url'.format(hyperlink))
@@ -27,7 +29,8 @@ def process(sheet, section_data, context):
     # TODO: extract pages from pdf as images
     if data is not None and 'pdf_path' in data:
         pdf_file = data['pdf_path']
-        pdf_name = data['pdf_name']
+        # page images are named after the cached file, two different pdfs with the same name must not overwrite each other's pages
+        pdf_name = os.path.basename(pdf_file)
         if pdf_name.endswith('pdf'):
             pdf_name = pdf_name[:-4]
             # print(pdf_name)
@@ -13,13 +13,135 @@ import pygsheets
 import urllib.request
 
 from helper.logger import *
+from helper.tracer import span
 from helper.gsheet.gsheet_util import *
+from helper.gsheet.gsheet_cache import *
 from helper.gdrive.gdrive_util import *
+from helper.gsheet.worksheet_ir import Worksheet
 
 COLUMNS = [ 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
             'AA', 'AB', 'AC', 'AD', 'AE', 'AF', 'AG', 'AH', 'AI', 'AJ', 'AK', 'AL', 'AM', 'AN', 'AO', 'AP', 'AQ', 'AR', 'AS', 'AT', 'AU', 'AV', 'AW', 'AX', 'AY', 'AZ',
             'BA', 'BB', 'BC', 'BD', 'BE', 'BF', 'BG', 'BH', 'BI', 'BJ', 'BK', 'BL', 'BM', 'BN', 'BO', 'BP', 'BQ', 'BR', 'BS', 'BT', 'BU', 'BV', 'BW', 'BX', 'BY', 'BZ']
 
+# partial response field mask for grid data requests, only what the processors and the docx renderer actually read is requested
+# the cell fields are configurable (gsheet-cell-fields) so that new note directives can ask for more
+GRID_FIELDS = 'spreadsheetId,sheets(properties(sheetId,title,gridProperties(rowCount,columnCount)),merges,data(startRow,startColumn,rowMetadata(pixelSize),columnMetadata(pixelSize),rowData(values({0}))))'
+CELL_FIELDS = [
+    'formattedValue',
+    'note',
+    'textFormatRuns',
+    'userEnteredValue(formulaValue)',
+    'effectiveFormat(textFormat,horizontalAlignment,verticalAlignment,backgroundColor,borders,textRotation)'
+]
+
+def worksheet_range(ws):
+    return '{0}!B3:{1}{2}'.format(a1_title(ws.title), COLUMNS[ws.cols-1], ws.rows)
+
+def linked_worksheet_titles(sheet, response, context):
+    # titles of the worksheets this worksheet links to through =HYPERLINK("#gid=...", "...") formulas
+    titles = []
+    for row_data in response['sheets'][0]['data'][0].get('rowData', []):
+        for cell_data in row_data.get('values', []):
+            formulaValue = cell_data.get('userEnteredValue', {}).get('formulaValue')
+            if formulaValue is None:
+                continue
+
+            m = re.match(r'=HYPERLINK\("#gid=(?P<ws_gid>.+)",\s*"(?P<ws_title>.+)"\)', formulaValue, re.IGNORECASE)
+            if m and m.group('ws_gid') is not None and m.group('ws_title') is not None:
+                ws = linked_worksheet(sheet, m.group('ws_gid'), m.group('ws_title'), context)
+                if ws is not None:
+                    titles.append(ws.title)
+
+    return titles
+
+def linked_drive_ids(response):
+    # ids of the drive files this worksheet links to through =HYPERLINK("https://drive.google.com/file/d/...", "...") formulas
+    ids = []
+    for row_data in response['sheets'][0]['data'][0].get('rowData', []):
+        for cell_data in row_data.get('values', []):
+            formulaValue = cell_data.get('userEnteredValue', {}).get('formulaValue')
+            if formulaValue is None:
+                continue
+
+            m = re.match(r'=HYPERLINK\("(?P<link_url>https://drive.google.com/file/d/.+)",\s*"(?P<link_title>.+)"\)', formulaValue, re.IGNORECASE)
+            if m:
+                ids.append(drive_file_id(m.group('link_url')))
+
+    return ids
+
+def fetch_batch(sheet, batch, context):
+    info('fetching ... {0} : {1} worksheet(s) in one request'.format(sheet.title, len(batch)))
+    request = context['service'].spreadsheets().get(spreadsheetId=sheet.id, ranges=[worksheet_range(ws) for ws in batch], includeGridData=True, fields=context['gsheet-grid-fields'])
+    with span('worksheet-fetch', gsheet=sheet.title, worksheets=', '.join(ws.title for ws in batch), rows=sum(ws.rows for ws in batch), cols=max(ws.cols for ws in batch)):
+        response = execute_request(request, context)
+
+    responses = {}
+    batch_worksheets = {ws.title: ws for ws in batch}
+    for sheet_data in response['sheets']:
+        ws_title = sheet_data['properties']['title']
+        ws_response = {k: v for k, v in response.items() if k != 'sheets'}
+        ws_response['sheets'] = [sheet_data]
+        responses[ws_title] = ws_response
+
+        if ws_title in batch_worksheets:
+            save_response(sheet, batch_worksheets[ws_title], ws_response, context)
+
+    return responses
+
+def fetch_worksheets(sheet, worksheets, context):
+    # one spreadsheets.get call for (at most) gsheet-batch-size worksheets, the response is split into one response per worksheet so that it looks exactly like a single range response
+    responses = {}
+
+    # worksheets found in the on-disk cache are not fetched at all
+    for ws in worksheets:
+        response = load_response(sheet, ws, context)
+        if response is not None:
+            responses[ws.title] = response
+
+    worksheets = [ws for ws in worksheets if ws.title not in responses]
+    batch_size = context['gsheet-batch-size']
+    batches = [worksheets[i:i + batch_size] for i in range(0, len(worksheets), batch_size)]
+
+    # the batches are fetched concurrently
+    for batch_responses in context['fetch-engine'].map(lambda batch: fetch_batch(sheet, batch, context), batches):
+        responses.update(batch_responses)
+
+    return responses
+
+def prefetch(sheet, ws_titles, context, drive_ids=[]):
+    '''
+        fetches all the worksheets in ws_titles (and the worksheets they link to, level by level) with as few spreadsheets.get calls as possible and feeds the worksheet-cache
+        so that process() for any of them is just a cache lookup
+        drive files referred from the fetched worksheets (and drive_ids) are resolved in bulk and downloaded concurrently before that
+    '''
+    prefetched = context['worksheet-prefetch'].setdefault(sheet.title, {})
+    cached = context['worksheet-cache'][sheet.title]
+
+    pending = list(dict.fromkeys(ws_titles))
+    while len(pending) > 0:
+        worksheets = []
+        for ws_title in pending:
+            if ws_title in cached or ws_title in prefetched:
+                continue
+
+            ws = worksheet_meta(sheet, ws_title, context)
+            if ws is not None:
+                worksheets.append(ws)
+
+        responses = fetch_worksheets(sheet, worksheets, context)
+        prefetched.update(responses)
+
+        # worksheets linked from the fetched ones go in the next round
+        pending = list(dict.fromkeys(t for response in responses.values() for t in linked_worksheet_titles(sheet, response, context)))
+
+    drive_ids = drive_ids + [id for response in prefetched.values() for id in linked_drive_ids(response)]
+    if len(drive_ids) > 0:
+        download_drive_files(drive_ids, context)
+
+    # post-process everything we have fetched, this fills the worksheet-cache
+    for ws_title in list(prefetched.keys()):
+        process(sheet, {'link': ws_title}, context)
+
 def process(sheet, section_data, context):
     ws_title = section_data['link']
 
@@ -28,32 +150,21 @@ def process(sheet, section_data, context):
         return context['worksheet-cache'][sheet.title][ws_title]
 
     info('processing ... {0} : {1}'.format(sheet.title, ws_title))
-    try:
-        ws = sheet.worksheet('title', ws_title)
-    except:
-        warn('No worksheet ... {0}'.format(ws_title))
-        return {}
-
-    ranges = ['{0}!B3:{1}{2}'.format(ws_title, COLUMNS[ws.cols-1], ws.rows)]
-    include_grid_data = True
-
-    wait_for = context['gsheet-read-wait-seconds']
-    try_count = context['gsheet-read-try-count']
-    request = context['service'].spreadsheets().get(spreadsheetId=sheet.id, ranges=ranges, includeGridData=include_grid_data)
-    response = None
-    for i in range(0, try_count):
-        try:
-            response = request.execute()
-            break
-        except:
-            warn('gsheet read request (attempt {0}) failed, waiting for {1} seconds before trying again'.format(i, wait_for))
-            time.sleep(float(wait_for))
-
-    if response is None:
-        error('gsheet read request failed, quiting')
-        sys.exit(1)
+
+    # if the worksheet has been fetched by prefetch, we only need to process it
+    prefetched = context['worksheet-prefetch'].get(sheet.title, {})
+    if ws_title in prefetched:
+        response = prefetched.pop(ws_title)
+    else:
+        ws = worksheet_meta(sheet, ws_title, context)
+        if ws is None:
+            return {}
+
+        response = fetch_worksheets(sheet, [ws], context)[ws.title]
 
     # if any of the cells have userEnteredValue of IMAGE or HYPERLINK, process it
+    # images are only collected here, they are downloaded together (concurrently) once all cells have been looked at
+    images = []
     row = 0
     for row_data in response['sheets'][0]['data'][0]['rowData']:
         val = 0
@@ -70,16 +181,15 @@ def process(sheet, section_data, context):
                         m = re.match('=IMAGE\((?P<name>.+)\)', formulaValue, re.IGNORECASE)
                         if m and m.group('name') is not None:
                             row_height = response['sheets'][0]['data'][0]['rowMetadata'][row]['pixelSize']
-                            result = download_image(m.group('name'), context['tmp-dir'], row_height)
-                            if result:
-                                response['sheets'][0]['data'][0]['rowData'][row]['values'][val]['userEnteredValue']['image'] = result
+                            images.append((cell_data, m.group('name'), row_height))
 
                         # content can be a HYPERLINK/hyperlink to another worksheet
                         m = re.match('=HYPERLINK\("#gid=(?P<ws_gid>.+)",\s*"(?P<ws_title>.+)"\)', formulaValue, re.IGNORECASE)
                         if m and m.group('ws_gid') is not None and m.group('ws_title') is not None:
                             # debug(m.group('ws_gid'), m.group('ws_title'))
-                            if worksheet_exists(sheet, m.group('ws_title')):
-                                cell_data['contents'] = process(sheet, {'link': m.group('ws_title')}, context)
+                            ws = linked_worksheet(sheet, m.group('ws_gid'), m.group('ws_title'), context)
+                            if ws is not None:
+                                cell_data['contents'] = process(sheet, {'link': ws.title}, context)
 
                         # content can be a HYPERLINK/hyperlink to another gdrive file (for now we only allow text only content, that is a text file)
                         m = re.match('=HYPERLINK\("(?P<link_url>.+)",\s*"(?P<link_title>.+)"\)', formulaValue, re.IGNORECASE)
@@ -94,11 +204,20 @@ def process(sheet, section_data, context):
 
                             # or it may be a web url
                             elif url.startswith('http'):
-                                text = read_web_content(url)
+                                text = read_web_content(url, context)
                                 if text is not None: cell_data['formattedValue'] = text
 
                 val = val + 1
         row = row + 1
 
-    context['worksheet-cache'][sheet.title][ws_title] = response
-    return response
+    # download the images and fill in the image specs the renderer expects
+    if len(images) > 0:
+        results = download_images([(image_formula, row_height) for cell_data, image_formula, row_height in images], context)
+        for (cell_data, image_formula, row_height), result in zip(images, results):
+            if result:
+                cell_data['userEnteredValue']['image'] = result
+
+    # the renderer works on the compact form of the worksheet, the response is not kept
+    worksheet = Worksheet.from_dict(response)
+    context['worksheet-cache'][sheet.title][ws_title] = worksheet
+    return worksheet